@@ -0,0 +1,12 @@
+"""
+性能测试脚本，运行方式见各文件开头，都在项目根目录用python -m benchmarks.xxx运行
+
+每个脚本都在临时目录里建自己的数据库。导入covid19包时main.py会在settings.database_url上建表、升级索引，
+所以这里先把COVID19_DATABASE_URL指到临时目录，不会改动仓库里的covid19.sqlite3（bench_load会再换成它自己的数据库）
+"""
+
+import os
+import tempfile
+
+_database_dir = tempfile.TemporaryDirectory()   # 进程退出时删除
+os.environ['COVID19_DATABASE_URL'] = f'sqlite:///{os.path.join(_database_dir.name, "covid19.sqlite3")}'
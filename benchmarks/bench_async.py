@@ -0,0 +1,93 @@
+"""
+同步会话（线程池） vs 异步会话（事件循环） 的只读接口吞吐量对比
+
+两组接口执行完全相同的查询（crud.select_data），区别只在于用SessionLocal还是AsyncSessionLocal。
+运行方式（在项目根目录）：python -m benchmarks.bench_async [并发数] [每组请求数]
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+import httpx
+from fastapi import Depends, FastAPI
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from benchmarks.bench_ingest import bulk, make_rows
+from covid19 import async_crud, crud
+from covid19.database import Base
+
+
+def build_app(path:str):
+    engine = create_engine(f'sqlite:///{path}', connect_args={'check_same_thread': False})
+    Base.metadata.create_all(bind=engine)
+    SessionLocal = sessionmaker(bind=engine, autocommit=False, autoflush=False)
+    db = SessionLocal()
+    bulk(db, *make_rows(11451))
+    db.close()
+    async_engine = create_async_engine(f'sqlite+aiosqlite:///{path}')
+    AsyncSessionLocal = async_sessionmaker(bind=async_engine, expire_on_commit=False)
+
+    def get_db():
+        db = SessionLocal()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    async def get_async_db():
+        async with AsyncSessionLocal() as db:
+            yield db
+
+    app = FastAPI()
+
+    @app.get('/sync/get_data')
+    def sync_get_data(city:str=None, limit:int=10, db=Depends(get_db)):
+        return [d.id for d in crud.get_data(db, city=city, limit=limit, after='')]
+
+    @app.get('/async/get_data')
+    async def async_get_data(city:str=None, limit:int=10, db=Depends(get_async_db)):
+        return [d.id for d in await async_crud.get_data(db, city=city, limit=limit, after='')]
+
+    return app, async_engine
+
+
+async def run(app:FastAPI, path:str, concurrency:int, requests:int):
+    latencies = []
+    queue = iter(range(requests))
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url='http://bench') as client:
+        async def worker():
+            for i in queue:
+                start = time.perf_counter()
+                response = await client.get(path, params={'city': f'P{i % 33}', 'limit': 50})
+                response.raise_for_status()
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    latencies.sort()
+    return requests / elapsed, latencies[len(latencies) // 2] * 1000, latencies[int(len(latencies) * 0.99)] * 1000
+
+
+async def compare(path:str, concurrency:int, requests:int):
+    app, async_engine = build_app(path)
+    try:
+        for url in ('/sync/get_data', '/async/get_data'):
+            rps, p50, p99 = await run(app, url, concurrency, requests)
+            print(f'{url:>16}: 并发 {concurrency}, {rps:,.0f} 请求/秒, p50 {p50:.1f} ms, p99 {p99:.1f} ms')
+    finally:
+        await async_engine.dispose()
+
+
+def main(concurrency:int=100, requests:int=2000):
+    with tempfile.TemporaryDirectory() as tmp:
+        asyncio.run(compare(os.path.join(tmp, 'bench.sqlite3'), concurrency, requests))
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,82 @@
+"""
+写入接口对比：逐条调用/create_data vs 一次调用/bulk_data（JSON数组 / NDJSON）
+
+直接调用应用（TestClient），数据库是临时文件，写入相同的N条数据（33个城市，每个城市N/33天）。
+运行方式（在项目根目录）：python -m benchmarks.bench_bulk_api [条数]
+"""
+
+import json
+import os
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from benchmarks.bench_ingest import make_rows
+from covid19 import crud
+from covid19.database import Base
+from covid19.main import get_db
+from run import app
+
+
+def fresh_database(path:str):
+    engine = create_engine(f'sqlite:///{path}', connect_args={'check_same_thread': False})
+    Base.metadata.create_all(bind=engine)
+    SessionLocal = sessionmaker(bind=engine, autoflush=False)
+    db = SessionLocal()
+    crud.bulk_create_cities(db=db, cities=make_rows(33)[0])
+    db.commit()
+    db.close()
+
+    def bench_get_db():
+        db = SessionLocal()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    app.dependency_overrides[get_db] = bench_get_db
+    return engine
+
+
+def make_points(total:int):
+    per_city = max(total // 33, 1)
+    return [{'city': f'P{i // per_city}', 'date': (date(2020, 1, 22) + timedelta(days=i % per_city)).isoformat(),
+             'confirmed': i, 'deaths': 0, 'recovered': 0} for i in range(per_city * 33)]
+
+
+def one_by_one(client, points):
+    for point in points:
+        point = dict(point)
+        city = point.pop('city')
+        client.post('/covid19/create_data', params={'city': city}, json=point).raise_for_status()
+
+
+def bulk_json(client, points):
+    client.post('/covid19/bulk_data', json=points).raise_for_status()
+
+
+def bulk_ndjson(client, points):
+    body = ''.join(json.dumps(point) + '\n' for point in points)
+    client.post('/covid19/bulk_data', content=body, headers={'Content-Type': 'application/x-ndjson'}).raise_for_status()
+
+
+def main(total:int=2000):
+    points = make_points(int(total))
+    with tempfile.TemporaryDirectory() as tmp, TestClient(app) as client:
+        for name, func in (('逐条/create_data', one_by_one), ('/bulk_data JSON', bulk_json), ('/bulk_data NDJSON', bulk_ndjson)):
+            engine = fresh_database(os.path.join(tmp, f'{func.__name__}.sqlite3'))
+            start = time.perf_counter()
+            func(client, points)
+            elapsed = time.perf_counter() - start
+            engine.dispose()
+            print(f'{name:>18}: {len(points)} 条 {elapsed:7.2f} 秒, {len(points) / elapsed:,.0f} 条/秒')
+        app.dependency_overrides.pop(get_db)
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
@@ -0,0 +1,83 @@
+"""
+响应压缩中间件：不压缩 vs gzip/brotli 不同级别，对比大的JSON列表响应的字节数和延迟
+
+/get_data和/cities走真实的路由（响应缓存命中后只剩序列化和压缩的开销），数据库是临时文件。
+传输时间按给定带宽估算：延迟 = 处理时间（服务端查询、序列化、压缩 + 客户端解压） + 字节数 / 带宽。
+运行方式（在项目根目录）：python -m benchmarks.bench_compression [带宽Mbit/s] [每组请求数]
+"""
+
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import httpx
+from fastapi import FastAPI
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from benchmarks.bench_ingest import bulk, make_rows, new_session
+from covid19.compression import CompressionMiddleware
+from covid19.main import application, get_async_db
+
+PATHS = ('/covid19/get_data?limit=1000', '/covid19/get_data?limit=5000', '/covid19/cities?limit=100')
+VARIANTS = (
+    ('不压缩', 'identity', {}),
+    ('gzip 1', 'gzip', {'gzip_level': 1}),
+    ('gzip 6', 'gzip', {'gzip_level': 6}),
+    ('gzip 9', 'gzip', {'gzip_level': 9}),
+    ('br 1', 'br', {'brotli_quality': 1}),
+    ('br 4', 'br', {'brotli_quality': 4}),
+    ('br 6', 'br', {'brotli_quality': 6}),
+)
+
+
+async def measure(app, path:str, encoding:str, requests:int):
+    timings, size = [], 0
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url='http://bench') as client:
+        for _ in range(requests):
+            start = time.perf_counter()
+            response = await client.get(path, headers={'Accept-Encoding': encoding})
+            response.raise_for_status()
+            timings.append(time.perf_counter() - start)
+            size = response.num_bytes_downloaded
+    return statistics.median(timings), size
+
+
+async def compare(path:str, bandwidth:float, requests:int):
+    async_engine = create_async_engine(f'sqlite+aiosqlite:///{path}')
+    AsyncSessionLocal = async_sessionmaker(bind=async_engine, expire_on_commit=False)
+
+    async def bench_get_async_db():
+        async with AsyncSessionLocal() as db:
+            yield db
+
+    inner = FastAPI()
+    inner.include_router(application, prefix='/covid19')
+    inner.dependency_overrides[get_async_db] = bench_get_async_db
+    try:
+        for url in PATHS:
+            print(url)
+            baseline = None
+            for label, encoding, options in VARIANTS:
+                server, size = await measure(CompressionMiddleware(inner, **options), url, encoding, requests)
+                latency = server + size * 8 / (bandwidth * 1e6)
+                baseline = baseline or latency
+                print(f'{label:>8}: {size / 1024:8.1f} KiB, 处理 {server * 1000:6.2f} ms, '
+                      f'{bandwidth:g} Mbit/s下总延迟 {latency * 1000:7.1f} ms（{latency / baseline:.0%}）')
+    finally:
+        await async_engine.dispose()
+
+
+def main(bandwidth:float=20, requests:int=20):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.sqlite3')
+        db = new_session(path)
+        bulk(db, *make_rows(11451))
+        db.close()
+        asyncio.run(compare(path, float(bandwidth), int(requests)))
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
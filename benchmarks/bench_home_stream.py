@@ -0,0 +1,79 @@
+"""
+首页（home.html）一次性渲染 vs 流式渲染（stream=true）的首字节时间和总耗时
+
+直接调用ASGI应用，记录第一个非空响应体到达的时间（首字节）和最后一块到达的时间（总耗时）。
+运行方式（在项目根目录）：python -m benchmarks.bench_home_stream [重复次数]
+"""
+
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from benchmarks.bench_ingest import bulk, make_rows
+from covid19.database import Base
+from covid19.main import get_db
+from run import app
+
+
+async def timed_get(path:str, query:str):
+    start = time.perf_counter()
+    first_byte = None
+    requested, finished = False, asyncio.Event()
+
+    async def receive():
+        nonlocal requested
+        if not requested:
+            requested = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        await finished.wait()       # 中间件会等客户端断开，响应发完之前不能返回disconnect
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        nonlocal first_byte
+        if message['type'] == 'http.response.body':
+            if message.get('body') and first_byte is None:
+                first_byte = time.perf_counter() - start
+            if not message.get('more_body'):
+                finished.set()
+
+    scope = {'type': 'http', 'http_version': '1.1', 'method': 'GET', 'scheme': 'http', 'server': ('bench', 80),
+             'path': path, 'raw_path': path.encode(), 'query_string': query.encode(), 'headers': [], 'root_path': ''}
+    await app(scope, receive, send)
+    return first_byte, time.perf_counter() - start
+
+
+def main(repeat:int=5):
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f'sqlite:///{os.path.join(tmp, "home.sqlite3")}', connect_args={'check_same_thread': False})
+        Base.metadata.create_all(bind=engine)
+        SessionLocal = sessionmaker(bind=engine, autoflush=False)
+        db = SessionLocal()
+        bulk(db, *make_rows(11451))
+        db.close()
+
+        def bench_get_db():
+            db = SessionLocal()
+            try:
+                yield db
+            finally:
+                db.close()
+
+        app.dependency_overrides[get_db] = bench_get_db
+        for limit in (100, 1000, 10000):
+            for stream in (False, True):
+                timings = [asyncio.run(timed_get('/covid19/', f'limit={limit}&stream={str(stream).lower()}'))
+                           for _ in range(repeat)]
+                ttfb = statistics.median(first for first, _ in timings) * 1000
+                total = statistics.median(total for _, total in timings) * 1000
+                print(f'limit={limit:>5} {"流式" if stream else "一次性"}: 首字节 {ttfb:7.1f} ms, 总耗时 {total:7.1f} ms')
+        engine.dispose()
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:]))
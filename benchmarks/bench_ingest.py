@@ -0,0 +1,67 @@
+"""
+同步数据写入性能对比：逐行 commit + refresh vs 单事务批量插入
+
+运行方式（在项目根目录）：python -m benchmarks.bench_ingest [行数]
+"""
+
+import os
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from covid19 import crud, schemas
+from covid19.database import Base
+
+
+def make_rows(total:int, provinces:int=33):
+    """生成和JHU同步数据规模相当的模拟数据"""
+    per_city = max(total // provinces, 1)
+    cities = [{'province': f'P{i}', 'country': 'China', 'country_code': 'CN', 'country_population': 1392730000}
+              for i in range(provinces)]
+    data = [{'date': date(2020, 1, 22) + timedelta(days=day), 'confirmed': day, 'deaths': 0, 'recovered': 0}
+            for _ in range(provinces) for day in range(per_city)]
+    return cities, data, per_city
+
+
+def new_session(path:str):
+    engine = create_engine(f'sqlite:///{path}', connect_args={'check_same_thread': False})
+    Base.metadata.create_all(bind=engine)
+    return sessionmaker(bind=engine, autocommit=False, autoflush=False)()
+
+
+def per_row(db, cities, data, per_city):
+    for city in cities:
+        crud.create_city(db=db, city=schemas.CreateCity(**city))
+    city_ids = crud.get_city_ids(db)
+    for i, row in enumerate(data):
+        city_id = city_ids[cities[i // per_city]['province']]
+        crud.create_city_data(db=db, data=schemas.CreateData(**row), city_id=city_id)
+
+
+def bulk(db, cities, data, per_city):
+    crud.bulk_create_cities(db=db, cities=cities)
+    city_ids = crud.get_city_ids(db)
+    data_city_ids = [city_ids[cities[i // per_city]['province']] for i in range(len(data))]
+    crud.bulk_create_city_data(db=db, data=data, city_ids=data_city_ids)
+    db.commit()
+
+
+def main(total:int=11451):
+    cities, data, per_city = make_rows(total)
+    rows = len(cities) + len(data)
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, func in (('per_row', per_row), ('bulk', bulk)):
+            db = new_session(os.path.join(tmp, f'{name}.sqlite3'))
+            start = time.perf_counter()
+            func(db, cities, data, per_city)
+            elapsed = time.perf_counter() - start
+            db.close()
+            print(f'{name:>8}: {rows} 行, {elapsed:.2f} 秒, {rows / elapsed:,.0f} 行/秒')
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:]))
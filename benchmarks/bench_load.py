@@ -0,0 +1,292 @@
+"""
+run.py整个应用的HTTP压测：固定的请求组合，输出吞吐量和延迟分位数（JSON），不同提交之间可以直接diff
+
+两种方式，请求组合和数据完全相同：
+- asgi：在本进程里通过httpx.ASGITransport调用run:app，没有网络和HTTP解析，只看应用本身（路由、中间件、数据库）
+- uvicorn：在子进程里启动uvicorn run:app，通过本机TCP端口请求，和真实部署一样
+数据库是临时目录里新建的SQLite文件（make_rows生成的模拟数据），通过COVID19_DATABASE_URL传给应用，
+不会用到也不会改动项目里的covid19.sqlite3。其他COVID19_*环境变量照常生效，例如COVID19_ENV=production。
+请求序列由随机种子决定，同样的参数每次发送的请求完全一样；正式计时前先按同样的组合预热。
+
+运行方式（在项目根目录）：
+    python -m benchmarks.bench_load [--mode asgi|uvicorn|both] [-c 并发数] [-n 请求数] [-o 结果.json]
+    python -m benchmarks.bench_load --compare 旧结果.json 新结果.json
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+
+import httpx
+
+USERNAME, PASSWORD = 'john snow', 'secret'     # tutorial/chapter06.py里的JWT测试用户
+PROVINCES = 33
+
+# (名称, 权重)；jwt_token每次都要做bcrypt校验（cost=12，约200毫秒，而且是在事件循环里算的），权重很小，否则结果全被它决定
+SCENARIOS = (
+    ('get_data', 30),
+    ('cities', 15),
+    ('city', 20),
+    ('home', 10),
+    ('jwt_users_me', 24),
+    ('jwt_token', 1),
+)
+
+
+def make_plan(requests:int, seed:int) -> list:
+    """按权重和随机种子生成请求序列，[(场景名, 方法, 路径, 查询参数)]"""
+    rng = random.Random(seed)
+    names = [name for name, _ in SCENARIOS]
+    weights = [weight for _, weight in SCENARIOS]
+    plan = []
+    for name in rng.choices(names, weights, k=requests):
+        city = f'P{rng.randrange(PROVINCES)}'
+        if name == 'get_data':
+            # 按城市查询时skip/limit只在游标分页时生效，after=''是第一页；不传after会返回这个城市的全部数据
+            plan.append((name, 'GET', '/covid19/get_data', {'city': city, 'after': '', 'limit': 50}))
+        elif name == 'cities':
+            plan.append((name, 'GET', '/covid19/cities', {'skip': rng.randrange(0, PROVINCES, 10), 'limit': 10}))
+        elif name == 'city':
+            plan.append((name, 'GET', f'/covid19/city/{city}', {}))
+        elif name == 'home':
+            plan.append((name, 'GET', '/covid19/', {'city': city, 'limit': 100}))
+        elif name == 'jwt_users_me':
+            plan.append((name, 'GET', '/chapter06/jwt/users/me', {}))
+        else:
+            plan.append((name, 'POST', '/chapter06/jwt/token', {}))
+    return plan
+
+
+def seed_database(path:str, rows:int):
+    # 导入covid19包时main.py就按settings建好了引擎，所以所有covid19的导入都要放在设置环境变量之后
+    from benchmarks.bench_ingest import bulk, make_rows
+    from covid19.database import Base, make_engine
+    from covid19.settings import Settings
+    from sqlalchemy.orm import sessionmaker
+
+    engine = make_engine(Settings(echo=False, database_url=f'sqlite:///{path}'))
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    bulk(db, *make_rows(rows, PROVINCES))
+    db.close()
+    engine.dispose()
+
+
+def percentile(sorted_values:list, q:float) -> float:
+    """最近秩法：不插值，结果一定是某次实际测到的延迟"""
+    if not sorted_values:
+        return 0.0
+    index = max(math.ceil(len(sorted_values) * q) - 1, 0)
+    return sorted_values[index]
+
+
+def summarize(latencies:list, errors:Counter, elapsed:float) -> dict:
+    latencies = sorted(latencies)
+    count = len(latencies)
+    return {
+        'requests': count,
+        'errors': dict(sorted(errors.items())),
+        'rps': round(count / elapsed, 1) if elapsed else 0.0,
+        'mean_ms': round(sum(latencies) / count * 1000, 3) if count else 0.0,
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+        'p90_ms': round(percentile(latencies, 0.90) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+        'max_ms': round(latencies[-1] * 1000, 3) if count else 0.0,
+    }
+
+
+async def login(client:httpx.AsyncClient) -> str:
+    response = await client.post('/chapter06/jwt/token', data={'username': USERNAME, 'password': PASSWORD})
+    response.raise_for_status()
+    return response.json()['access_token']
+
+
+async def drive(client:httpx.AsyncClient, plan:list, concurrency:int, token:str):
+    """concurrency个协程从同一个请求序列里取请求，返回(每个场景的延迟, 每个场景的错误, 总耗时)"""
+    latencies = defaultdict(list)
+    errors = defaultdict(Counter)
+    queue = iter(plan)
+    auth = {'Authorization': f'Bearer {token}'}
+    form = {'username': USERNAME, 'password': PASSWORD}
+
+    async def worker():
+        for name, method, path, params in queue:
+            start = time.perf_counter()
+            try:
+                if method == 'POST':
+                    response = await client.post(path, data=form)
+                else:
+                    response = await client.get(path, params=params, headers=auth if name.startswith('jwt') else None)
+                await response.aread()
+                status = response.status_code
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            latencies[name].append(time.perf_counter() - start)
+            if status != 200:
+                errors[name][str(status)] += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, errors, time.perf_counter() - start
+
+
+async def run_scenarios(client:httpx.AsyncClient, plan:list, warmup:list, concurrency:int) -> dict:
+    token = await login(client)
+    await drive(client, warmup, concurrency, token)
+    latencies, errors, elapsed = await drive(client, plan, concurrency, token)
+    result = {'overall': summarize([x for values in latencies.values() for x in values],
+                                   sum(errors.values(), Counter()), elapsed),
+              'scenarios': {}}
+    for name, _ in SCENARIOS:
+        # 每个场景的rps按整体耗时算，是这个场景在混合负载里分到的吞吐量
+        result['scenarios'][name] = summarize(latencies[name], errors[name], elapsed)
+    return result
+
+
+async def bench_asgi(plan:list, warmup:list, concurrency:int) -> dict:
+    from run import app     # 环境变量设置好以后才能导入，settings在导入时读取
+
+    async with app.router.lifespan_context(app):    # ASGITransport不发lifespan事件，手动进入，退出时关闭aiosqlite连接
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://bench') as client:
+            return await run_scenarios(client, plan, warmup, concurrency)
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+async def wait_ready(client:httpx.AsyncClient, server:subprocess.Popen, timeout:float=30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f'uvicorn exited with code {server.returncode}')
+        try:
+            if (await client.get('/covid19/cities', params={'limit': 1})).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.1)
+    raise RuntimeError(f'uvicorn not ready after {timeout}s')
+
+
+async def bench_uvicorn(plan:list, warmup:list, concurrency:int, workers:int) -> dict:
+    port = free_port()
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'run:app', '--host', '127.0.0.1', '--port', str(port),
+         '--workers', str(workers), '--log-level', 'warning', '--no-access-log'],
+        env=os.environ.copy())
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    try:
+        async with httpx.AsyncClient(base_url=f'http://127.0.0.1:{port}', limits=limits, timeout=60) as client:
+            await wait_ready(client, server)
+            return await run_scenarios(client, plan, warmup, concurrency)
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            server.kill()
+            server.wait()
+
+
+def git_commit() -> str:
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True)
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], capture_output=True, text=True)
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+    return commit.stdout.strip() + ('-dirty' if dirty.stdout.strip() else '')
+
+
+def compare(old_path:str, new_path:str):
+    """两次结果逐项对比：吞吐量和p50/p99的变化百分比"""
+    with open(old_path, encoding='utf-8') as f:
+        old = json.load(f)
+    with open(new_path, encoding='utf-8') as f:
+        new = json.load(f)
+    print(f"{old['meta']['commit']} -> {new['meta']['commit']}")
+    for mode in new['results']:
+        if mode not in old['results']:
+            continue
+        print(f'[{mode}]')
+        rows = [('overall', old['results'][mode]['overall'], new['results'][mode]['overall'])]
+        rows += [(name, old['results'][mode]['scenarios'].get(name), stats)
+                 for name, stats in new['results'][mode]['scenarios'].items()]
+        for name, before, after in rows:
+            if not before:
+                continue
+            changes = []
+            for key in ('rps', 'p50_ms', 'p99_ms'):
+                delta = (after[key] / before[key] - 1) * 100 if before[key] else 0.0
+                changes.append(f'{key} {before[key]:>9.1f} -> {after[key]:>9.1f} ({delta:+6.1f}%)')
+            print(f'  {name:<14}' + '   '.join(changes))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='run:app HTTP压测')
+    parser.add_argument('--mode', choices=('asgi', 'uvicorn', 'both'), default='both')
+    parser.add_argument('-c', '--concurrency', type=int, default=16, help='并发请求数')
+    parser.add_argument('-n', '--requests', type=int, default=2000, help='计时的请求数')
+    parser.add_argument('--warmup', type=int, default=200, help='预热的请求数，不计入结果')
+    parser.add_argument('--rows', type=int, default=11451, help='模拟数据的行数')
+    parser.add_argument('--seed', type=int, default=0, help='请求序列的随机种子')
+    parser.add_argument('--workers', type=int, default=1, help='uvicorn的worker进程数')
+    parser.add_argument('-o', '--output', help='结果写入这个文件，不指定时输出到标准输出')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='对比两次的结果文件')
+    args = parser.parse_args()
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    plan = make_plan(args.requests, args.seed)
+    warmup = make_plan(args.warmup, args.seed + 1)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'covid19.sqlite3')
+        os.environ['COVID19_DATABASE_URL'] = f'sqlite:///{path}'
+        os.environ.setdefault('COVID19_ECHO', 'false')     # 开发环境默认echo=True，每条SQL都打印，压测的是日志
+        seed_database(path, args.rows)
+        results = {}
+        if args.mode in ('asgi', 'both'):
+            results['asgi'] = asyncio.run(bench_asgi(plan, warmup, args.concurrency))
+        if args.mode in ('uvicorn', 'both'):
+            results['uvicorn'] = asyncio.run(bench_uvicorn(plan, warmup, args.concurrency, args.workers))
+
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'env': os.environ.get('COVID19_ENV', 'development'),
+            'concurrency': args.concurrency,
+            'requests': args.requests,
+            'warmup': args.warmup,
+            'rows': args.rows,
+            'seed': args.seed,
+            'workers': args.workers,
+            'scenarios': dict(SCENARIOS),
+        },
+        'results': results,
+    }
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""
+settings.py里各个引擎预设（development / production）的性能对比
+
+每个预设在一个新的临时数据库上：批量写入一次同步规模的数据（每5000行提交一次，相当于增量同步设置COVID19_SYNC_COMMIT_ROWS=5000），
+再用多个线程并发执行按城市和日期的范围查询。development会记录所有SQL语句，这里把日志写到/dev/null，
+只计算记录日志本身的开销，不计算终端输出的开销。
+运行方式（在项目根目录）：python -m benchmarks.bench_profiles [读线程数] [每个线程的查询数]
+"""
+
+import contextlib
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+
+from sqlalchemy.orm import sessionmaker
+
+from benchmarks.bench_ingest import make_rows
+from covid19 import crud
+from covid19.database import Base, make_engine
+from covid19.settings import PROFILES, Settings
+
+
+def ingest(SessionLocal, commit_rows:int=5000):
+    cities, data, per_city = make_rows(11451)
+    db = SessionLocal()
+    crud.bulk_create_cities(db=db, cities=cities)
+    city_ids = crud.get_city_ids(db)
+    for offset in range(0, len(data), commit_rows):
+        chunk = data[offset:offset + commit_rows]
+        crud.bulk_create_city_data(db=db, data=chunk, city_ids=[
+            city_ids[cities[(offset + i) // per_city]['province']] for i in range(len(chunk))])
+        db.commit()
+    db.close()
+    return len(cities) + len(data)
+
+
+def read(SessionLocal, queries:int):
+    db = SessionLocal()
+    for i in range(queries):
+        crud.get_data_range(db, city=f'P{i % 33}', start=date(2020, 3, 1), end=date(2020, 6, 1))
+    db.close()
+
+
+def main(threads:int=8, queries:int=250):
+    with tempfile.TemporaryDirectory() as tmp, open(os.devnull, 'w') as devnull:
+        for profile in PROFILES:
+            config = Settings(env=profile, database_url=f'sqlite:///{os.path.join(tmp, profile)}.sqlite3', **PROFILES[profile])
+            with contextlib.redirect_stdout(devnull):   # echo的日志处理器在创建引擎时绑定sys.stdout
+                engine = make_engine(config)
+            Base.metadata.create_all(bind=engine)
+            SessionLocal = sessionmaker(bind=engine, autoflush=False)
+
+            start = time.perf_counter()
+            rows = ingest(SessionLocal)
+            write_elapsed = time.perf_counter() - start
+
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=threads) as pool:
+                list(pool.map(lambda _: read(SessionLocal, queries), range(threads)))
+            read_elapsed = time.perf_counter() - start
+            engine.dispose()
+            print(f'{profile:>12}: 写入 {rows / write_elapsed:,.0f} 行/秒, '
+                  f'范围查询 {threads * queries / read_elapsed:,.0f} 次/秒（{threads} 线程）')
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,110 @@
+"""
+读写分离的效果：后台同步（反复删除并分批写入data表）进行时，读请求的吞吐和延迟
+
+读请求走只读引擎（和get_db一样），同步放在单独的进程里（相当于另一个uvicorn worker在同步），
+只比较SQLite文件锁的影响，不受GIL干扰。分别测没有同步、回滚日志模式下同步、WAL模式下同步三种情况：
+回滚日志模式下写事务提交时会锁住整个文件，读请求要等；WAL模式下读连接读的是快照，不受写入影响。
+运行方式（在项目根目录）：python -m benchmarks.bench_read_write [读线程数] [每个线程的查询数]
+"""
+
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import multiprocessing
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+
+from sqlalchemy.orm import sessionmaker
+
+from benchmarks.bench_ingest import make_rows
+from covid19 import crud, models
+from covid19.database import Base, make_engine
+from covid19.settings import PROFILES, Settings
+
+
+def seed(path:str):
+    config = Settings(echo=False, database_url=f'sqlite:///{path}')
+    engine = make_engine(config)
+    Base.metadata.create_all(bind=engine)
+    cities, data, per_city = make_rows(11451)
+    db = sessionmaker(bind=engine)()
+    crud.bulk_create_cities(db=db, cities=cities)
+    city_ids = crud.get_city_ids(db)
+    data_city_ids = [city_ids[cities[i // per_city]['province']] for i in range(len(data))]
+    crud.bulk_create_city_data(db=db, data=data, city_ids=data_city_ids)
+    db.commit()
+    db.close()
+    engine.dispose()
+    return data, data_city_ids
+
+
+def sync_forever(config:Settings, data, city_ids, stop, commit_rows:int=1000):
+    """和bg_task一样：先删掉旧数据，再分批写入、分批提交"""
+    engine = make_engine(config)
+    db = sessionmaker(bind=engine)()
+    while not stop.is_set():
+        db.execute(models.Data.__table__.delete())
+        for offset in range(0, len(data), commit_rows):
+            crud.bulk_create_city_data(db=db, data=data[offset:offset + commit_rows],
+                                       city_ids=city_ids[offset:offset + commit_rows])
+            db.commit()
+    db.close()
+    engine.dispose()
+
+
+def read(SessionLocal, queries:int):
+    latencies = []
+    db = SessionLocal()
+    for i in range(queries):
+        start = time.perf_counter()
+        crud.get_data_range(db, city=f'P{i % 33}', start=date(2020, 3, 1), end=date(2020, 6, 1))
+        db.rollback()       # 每个查询一个事务，和每个请求一个会话一样，不会一直读旧快照
+        latencies.append(time.perf_counter() - start)
+    db.close()
+    return latencies
+
+
+def run(path:str, journal_mode:str, data, city_ids, threads:int, queries:int, syncing:bool=True):
+    config = Settings(**{**PROFILES['production'], 'sqlite_journal_mode': journal_mode}, database_url=f'sqlite:///{path}')
+    write_engine = make_engine(config)
+    read_engine = make_engine(config, read_only=True)
+    ReadSession = sessionmaker(bind=read_engine)
+    with write_engine.connect():
+        pass                # 先用写连接建立一次连接，把journal_mode设置好
+
+    stop = multiprocessing.Event()
+    writer = multiprocessing.Process(target=sync_forever, args=(config, data, city_ids, stop))
+    if syncing:
+        writer.start()
+        time.sleep(0.5)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        latencies = [latency for result in pool.map(lambda _: read(ReadSession, queries), range(threads))
+                     for latency in result]
+    elapsed = time.perf_counter() - start
+    stop.set()
+    if syncing:
+        writer.join()
+    write_engine.dispose()
+    read_engine.dispose()
+    p99 = statistics.quantiles(latencies, n=100)[98]
+    return len(latencies) / elapsed, p99 * 1000
+
+
+def main(threads:int=4, queries:int=500):
+    with tempfile.TemporaryDirectory() as tmp:
+        seeded = os.path.join(tmp, 'seed.sqlite3')
+        data, city_ids = seed(seeded)
+        for label, journal_mode, syncing in (('没有同步', 'DELETE', False), ('同步中, DELETE', 'DELETE', True),
+                                             ('同步中, WAL', 'WAL', True)):
+            path = os.path.join(tmp, f'{journal_mode}-{syncing}.sqlite3')
+            shutil.copy(seeded, path)
+            qps, p99 = run(path, journal_mode, data, city_ids, threads, queries, syncing)
+            print(f'{label:>14}: 范围查询 {qps:,.0f} 次/秒, p99 {p99:.1f} ms（{threads} 线程）')
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:]))
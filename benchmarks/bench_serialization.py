@@ -0,0 +1,74 @@
+"""
+List[ReadData]响应的逐行序列化开销：FastAPI默认路径 vs FastJSONRoute，以及缓存未命中时的cache_response
+
+接口直接返回内存里的ORM对象（不查库），只测序列化；每行耗时 = 单次请求耗时 / 行数。
+- APIRoute：response_model校验 -> 序列化成dict -> json.dumps（FastAPI默认）
+- FastJSONRoute：预编译TypeAdapter校验后直接输出JSON字节（settings.fast_json）
+- 每次新建TypeAdapter：改动前cache_response的写法，对照用
+运行方式（在项目根目录）：python -m benchmarks.bench_serialization [行数] [重复次数]
+"""
+
+import statistics
+import sys
+import time
+from datetime import date, datetime, timedelta
+from typing import List
+
+from fastapi import APIRouter, FastAPI
+from fastapi.routing import APIRoute
+from fastapi.testclient import TestClient
+from pydantic import TypeAdapter
+
+from covid19 import models, schemas
+from covid19.serialization import FastJSONRoute, dump_json
+
+
+def make_data(rows:int):
+    now = datetime(2020, 6, 1, 12, 0, 0)
+    return [models.Data(id=i, city_id=i % 33, date=date(2020, 1, 22) + timedelta(days=i % 400), confirmed=i,
+                        deaths=i // 10, recovered=i // 2, created_at=now, updated_at=now) for i in range(rows)]
+
+
+def build_client(route_class, data):
+    router = APIRouter(route_class=route_class)
+
+    @router.get('/get_data', response_model=List[schemas.ReadData])
+    async def read_data():
+        return data
+
+    app = FastAPI()
+    app.include_router(router)
+    return TestClient(app)
+
+
+def per_row(func, rows:int, repeat:int) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) / rows * 1e6
+
+
+def uncached_adapter(data):
+    adapter = TypeAdapter(List[schemas.ReadData])
+    return adapter.dump_json(adapter.validate_python(data, from_attributes=True))
+
+
+def main(rows:int=5000, repeat:int=20):
+    rows, repeat = int(rows), int(repeat)
+    data = make_data(rows)
+    default, fast = build_client(APIRoute, data), build_client(FastJSONRoute, data)
+    assert default.get('/get_data').json() == fast.get('/get_data').json()
+    results = {
+        'APIRoute（默认）': per_row(lambda: default.get('/get_data'), rows, repeat),
+        'FastJSONRoute': per_row(lambda: fast.get('/get_data'), rows, repeat),
+        '每次新建TypeAdapter': per_row(lambda: uncached_adapter(data), rows, repeat),
+        'dump_json（预编译）': per_row(lambda: dump_json(List[schemas.ReadData], data), rows, repeat),
+    }
+    for label, micros in results.items():
+        print(f'{label:>16}: 每行 {micros:.2f} µs（{rows} 行）')
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
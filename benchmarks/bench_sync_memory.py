@@ -0,0 +1,61 @@
+"""
+同步任务的峰值内存：timelines响应体越大，峰值内存是否跟着变大
+
+用httpx.MockTransport按需生成响应体（不在内存里拼出整个JSON），用tracemalloc统计bg_task执行期间的峰值。
+运行方式（在项目根目录）：python -m benchmarks.bench_sync_memory
+"""
+
+import json
+import os
+import tempfile
+import tracemalloc
+from datetime import date, timedelta
+
+import httpx
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from covid19.database import Base
+from covid19.jhu import JHUClient
+from covid19.main import bg_task
+
+
+def location(i:int, days:int, timelines:bool) -> dict:
+    item = {'province': f'P{i}', 'country': 'China', 'country_population': 1392730000}
+    if timelines:
+        timeline = {f'{date(2020, 1, 22) + timedelta(days=d)}T00:00:00Z': d for d in range(days)}
+        item['timelines'] = {'confirmed': {'timeline': timeline}, 'deaths': {'timeline': timeline}}
+    return item
+
+
+def handler(provinces:int, days:int):
+    def generate():
+        yield b'{"locations": ['
+        for i in range(provinces):
+            yield (b', ' if i else b'') + json.dumps(location(i, days, True)).encode()
+        yield b']}'
+
+    def handle(request):
+        if request.url.params['timelines'] == 'false':
+            return httpx.Response(200, json={'locations': [location(i, days, False) for i in range(provinces)]})
+        return httpx.Response(200, content=generate())
+    return handle
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        for provinces in (50, 200, 800):
+            engine = create_engine(f'sqlite:///{os.path.join(tmp, f"{provinces}.sqlite3")}')
+            Base.metadata.create_all(bind=engine)
+            db = sessionmaker(bind=engine)()
+            client = JHUClient('http://jhu.test', transport=httpx.MockTransport(handler(provinces, 365)))
+            tracemalloc.start()
+            stats = bg_task(url='', db=db, client=client)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            db.close()
+            print(f'{provinces:>4} 个城市, {stats["rows"]:>7} 行: 峰值内存 {peak / 2 ** 20:.1f} MiB, {stats["rows_per_sec"]:,.0f} 行/秒')
+
+
+if __name__ == '__main__':
+    main()
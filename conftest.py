@@ -0,0 +1,14 @@
+"""
+pytest收集测试模块之前先加载这个文件。导入covid19包时main.py会在settings.database_url上建表、升级索引、回填汇总表，
+所以在这里把COVID19_DATABASE_URL指到临时目录，跑测试不会改动仓库里的covid19.sqlite3
+"""
+
+import os
+import tempfile
+
+_database_dir = tempfile.TemporaryDirectory()
+os.environ['COVID19_DATABASE_URL'] = f'sqlite:///{os.path.join(_database_dir.name, "covid19.sqlite3")}'
+
+
+def pytest_unconfigure(config):
+    _database_dir.cleanup()
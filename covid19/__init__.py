@@ -6,9 +6,22 @@ covid19/
     static              存放静态文件
     template            前端代码
     models.py           模型类（对应数据库中的数据表）
+    settings.py         配置（环境变量，开发/生产环境预设）
     database.py         数据库配置
     schemas.py           响应体数据格式规范 （pydantic对应的模型类）
     crud.py             数据库操作
+    async_crud.py       数据库操作（异步版本）
+    migrations.py       已有数据库的原地升级（补索引）
+    cache.py            只读接口的响应缓存和数据集版本号（ETag）
+    analytics.py        时间序列分析（NumPy向量化计算）
+    columnar.py         data表的内存列式快照（可选的读引擎）
+    jhu.py              JHU数据源的HTTP客户端（同步数据用）
+    jobs.py             同步任务管理（去重、状态和进度）
+    assets.py           静态文件构建（内容哈希文件名、预压缩）和发送
+    compression.py      响应压缩中间件（gzip/brotli）
+    serialization.py    响应体的快速JSON序列化（预编译的TypeAdapter）
+    metrics.py          请求指标（每个路由的延迟直方图等，Prometheus格式的/metrics）
+    profiler.py         SQL查询分析（每个请求的查询数和耗时、慢查询日志、N+1检测）
     main.py             应用入口
 
 '''
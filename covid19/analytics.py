@@ -0,0 +1,94 @@
+"""
+时间序列分析：每日新增、N日移动平均、增长率、翻倍时间
+
+一次查询取回所有要分析的城市的数据，放进NumPy数组，所有城市一起做向量化计算，
+不逐行、也不逐个城市循环。
+"""
+
+from typing import Dict, List, Optional
+
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from covid19 import models
+
+
+def load_series(db:Session, provinces:Optional[List[str]]=None):
+    """
+    一次查询取回城市的(province, date, confirmed, deaths)，按(city_id, date)排序（走索引），
+    返回省份名数组、每个城市在数组中的起始下标，以及日期、确诊、死亡三个数组
+    """
+    stmt = (select(models.Data.city_id, models.City.province, models.Data.date, models.Data.confirmed, models.Data.deaths)
+            .join(models.City, models.Data.city_id == models.City.id)
+            .order_by(models.Data.city_id, models.Data.date))
+    if provinces:
+        stmt = stmt.where(models.City.province.in_(provinces))
+    # 绕过SQLAlchemy逐行的类型转换（比如把日期字符串转成date对象），直接交给驱动执行，日期交给NumPy批量解析
+    compiled = stmt.compile(dialect=db.get_bind().dialect, compile_kwargs={'render_postcompile': True})
+    params = tuple(compiled.params[key] for key in compiled.positiontup or ())
+    rows = db.connection().exec_driver_sql(str(compiled), params).all()
+    if not rows:
+        return [], np.empty(0, dtype=np.int64), np.empty(0, dtype='datetime64[D]'), np.empty(0), np.empty(0)
+    city_ids, names, dates, confirmed, deaths = zip(*rows)
+    city_ids = np.array(city_ids, dtype=np.int64)
+    starts = np.flatnonzero(np.r_[True, city_ids[1:] != city_ids[:-1]])   # 每个城市第一行的下标
+    return ([names[i] for i in starts], starts, np.array(dates, dtype='datetime64[D]'),
+            np.array(confirmed, dtype=np.float64), np.array(deaths, dtype=np.float64))
+
+
+def compute_metrics(starts:np.ndarray, confirmed:np.ndarray, window:int=7) -> Dict[str, np.ndarray]:
+    """
+    对拼接在一起的多个城市的累计确诊数组做向量化计算，starts是每个城市的起始下标。
+    用“在本城市内的序号”pos做掩码，保证差分、移动平均不会跨越两个城市的边界。
+    数据不足的位置是NaN。
+    """
+    n = len(confirmed)
+    lengths = np.diff(np.r_[starts, n])
+    pos = np.arange(n) - np.repeat(starts, lengths)     # 每一行在所属城市里是第几天
+
+    previous = np.r_[0.0, confirmed[:-1]]
+    previous[pos == 0] = 0.0
+    new_cases = confirmed - previous    # 每日新增，第一天按前一天为0计算，和汇总表一致
+
+    # 移动平均：累加和相减，O(n)，不随window变大而变慢
+    cumsum = np.r_[0.0, np.cumsum(new_cases)]
+    moving_average = np.full(n, np.nan)
+    valid = pos >= window - 1
+    index = np.flatnonzero(valid)
+    moving_average[valid] = (cumsum[index + 1] - cumsum[index + 1 - window]) / window
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        growth_rate = np.where((pos >= 1) & (previous > 0), confirmed / previous - 1, np.nan)
+        # 翻倍时间：用最近window天的累计增长倍数推算，window * ln2 / ln(c[t] / c[t-window])
+        before = np.full(n, np.nan)
+        valid = pos >= window
+        before[valid] = confirmed[np.flatnonzero(valid) - window]
+        ratio = confirmed / before
+        doubling_time = np.where(ratio > 1, window * np.log(2) / np.log(ratio), np.nan)
+
+    return {
+        'new_cases': new_cases,
+        'new_cases_ma': moving_average,
+        'growth_rate': growth_rate,
+        'doubling_time': doubling_time,
+    }
+
+
+def _to_list(values:np.ndarray) -> list:
+    """NaN/inf转成None，JSON里就是null"""
+    return np.where(np.isfinite(values), values, None).tolist()
+
+
+def city_analytics(db:Session, provinces:Optional[List[str]]=None, window:int=7) -> List[dict]:
+    """按城市拆分计算结果，每个城市的各项指标都是和dates对齐的列表（列式，体积小）"""
+    names, starts, dates, confirmed, deaths = load_series(db, provinces)
+    metrics = compute_metrics(starts, confirmed, window=window)
+    ends = np.r_[starts[1:], len(confirmed)]
+    return [{
+        'province': name,
+        'dates': dates[start:end].astype(str).tolist(),
+        'confirmed': confirmed[start:end].astype(np.int64).tolist(),
+        'deaths': deaths[start:end].astype(np.int64).tolist(),
+        **{key: _to_list(values[start:end]) for key, values in metrics.items()},
+    } for name, start, end in zip(names, starts, ends)]
@@ -0,0 +1,159 @@
+"""
+静态文件的构建和发送：带内容哈希的文件名 + 预压缩（gzip/brotli）+ 长期缓存
+
+构建（部署前执行一次，生成的文件不提交到git）：
+    python -m covid19.assets
+把covid19/static下的文件复制到covid19/static/build/，文件名里加上内容哈希，例如semantic.min.3f2a9c1d4b5e.css，
+同时写出.gz和.br压缩版本（比原文件小才写），以及manifest.json（原路径 -> 带哈希的路径）。
+
+发送：PrecompressedStaticFiles根据Accept-Encoding直接发送压缩好的文件，不在请求里压缩；
+带哈希的文件内容永远不变，所以可以让浏览器缓存一年（Cache-Control: immutable）。
+模板里的url_for('static', path=...)通过manifest换成带哈希的文件名，没有构建过时保持原文件名。
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import shutil
+from mimetypes import guess_type
+
+import anyio
+from fastapi.staticfiles import StaticFiles
+from jinja2 import pass_context
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse
+
+STATIC_DIR = 'covid19/static'
+BUILD_DIR = 'build'                 # STATIC_DIR下的构建输出目录
+MANIFEST = 'manifest.json'
+COMPRESSIBLE = {'.css', '.js', '.map', '.html', '.svg', '.json', '.txt'}    # 图片、字体等本身已压缩的文件不再压缩
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))                                # 按优先级排列
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+
+def fingerprint(path:str, content:bytes) -> str:
+    """semantic.min.css -> semantic.min.<内容哈希>.css；.map文件保留原名，因为.js里按原名引用它"""
+    root, ext = os.path.splitext(path)
+    if ext == '.map':
+        return path
+    return f'{root}.{hashlib.sha256(content).hexdigest()[:12]}{ext}'
+
+
+def compress(content:bytes) -> dict:
+    """返回 扩展名 -> 压缩后的内容，压缩后没有变小的不返回"""
+    import brotli   # 只有构建时需要，应用启动（发送已经构建好的文件）不依赖brotli
+
+    variants = {
+        '.gz': gzip.compress(content, compresslevel=9, mtime=0),    # mtime=0让同样的输入得到同样的输出
+        '.br': brotli.compress(content, quality=11),
+    }
+    return {suffix: data for suffix, data in variants.items() if len(data) < len(content)}
+
+
+def build(static_dir:str=STATIC_DIR) -> dict:
+    """重新生成构建目录，返回manifest"""
+    out_dir = os.path.join(static_dir, BUILD_DIR)
+    shutil.rmtree(out_dir, ignore_errors=True)     # 清掉旧哈希的文件
+    manifest = {}
+    for root, dirs, files in os.walk(static_dir):
+        dirs[:] = sorted(d for d in dirs if os.path.join(root, d) != out_dir)
+        for name in sorted(files):
+            path = os.path.relpath(os.path.join(root, name), static_dir).replace(os.sep, '/')
+            with open(os.path.join(static_dir, path), 'rb') as f:
+                content = f.read()
+            target = f'{BUILD_DIR}/{fingerprint(path, content)}'
+            os.makedirs(os.path.dirname(os.path.join(static_dir, target)), exist_ok=True)
+            with open(os.path.join(static_dir, target), 'wb') as f:
+                f.write(content)
+            if os.path.splitext(path)[1] in COMPRESSIBLE:
+                for suffix, data in compress(content).items():
+                    with open(os.path.join(static_dir, target + suffix), 'wb') as f:
+                        f.write(data)
+            if target != f'{BUILD_DIR}/{path}':
+                manifest[path] = target
+    with open(os.path.join(out_dir, MANIFEST), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+
+def load_manifest(static_dir:str=STATIC_DIR) -> dict:
+    try:
+        with open(os.path.join(static_dir, BUILD_DIR, MANIFEST), encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:   # 没有构建过（开发环境），直接用原文件
+        return {}
+
+
+manifest = load_manifest()
+
+
+def static_path(path:str) -> str:
+    """'/semantic.min.css' -> '/build/semantic.min.<哈希>.css'"""
+    target = manifest.get(path.lstrip('/'))
+    return f'/{target}' if target else path
+
+
+@pass_context
+def url_for(context:dict, name:str, /, **path_params):
+    """替换Jinja2Templates默认的url_for，静态文件换成带哈希的文件名"""
+    if name == 'static' and 'path' in path_params:
+        path_params['path'] = static_path(path_params['path'])
+    return context['request'].url_for(name, **path_params)
+
+
+def accepted_encodings(header:str) -> set:
+    """解析Accept-Encoding，返回客户端接受的编码（忽略q=0的）"""
+    encodings = set()
+    for item in header.split(','):
+        encoding, _, params = item.strip().partition(';')
+        quality = params.strip()
+        if quality.startswith('q='):
+            try:
+                if float(quality[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        if encoding:
+            encodings.add(encoding.strip().lower())
+    return encodings
+
+
+class PrecompressedStaticFiles(StaticFiles):
+    """
+    和StaticFiles一样发送directory下的文件；manifest里带哈希的文件加上长期缓存头，
+    并且客户端接受br/gzip、构建时生成了对应的压缩文件时，直接发送压缩文件。
+    """
+
+    def __init__(self, *, directory:str=STATIC_DIR, **kwargs):
+        super().__init__(directory=directory, **kwargs)
+        self.fingerprinted = set(load_manifest(directory).values())
+
+    async def get_response(self, path:str, scope) -> Response:
+        path = path.replace(os.sep, '/')
+        if path not in self.fingerprinted or scope['method'] not in ('GET', 'HEAD'):
+            return await super().get_response(path, scope)
+        request_headers = Headers(scope=scope)
+        accepted = accepted_encodings(request_headers.get('accept-encoding', ''))
+        response = None
+        for encoding, suffix in ENCODINGS:
+            if encoding not in accepted:
+                continue
+            full_path, stat_result = await anyio.to_thread.run_sync(self.lookup_path, path + suffix)
+            if stat_result is not None:
+                response = FileResponse(full_path, stat_result=stat_result, media_type=guess_type(path)[0],
+                                        headers={'Content-Encoding': encoding})
+                if self.is_not_modified(response.headers, request_headers):
+                    response = NotModifiedResponse(response.headers)
+                break
+        if response is None:
+            response = await super().get_response(path, scope)
+        response.headers['Cache-Control'] = IMMUTABLE
+        response.headers['Vary'] = 'Accept-Encoding'
+        return response
+
+
+if __name__ == '__main__':
+    for source, target in build().items():
+        print(f'{source} -> {target}')
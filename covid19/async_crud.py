@@ -0,0 +1,45 @@
+"""
+crud.py的异步版本，配合database.py里的AsyncSessionLocal使用，查询语句和crud.py共用
+异步引擎连的是读库（query_only），这里只有查询；写入都走crud.py和同步的写引擎
+"""
+
+from datetime import date
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from covid19 import models
+from covid19.crud import select_cities, select_city_summaries, select_data, select_export, select_national_daily
+
+
+async def get_city_by_name(db:AsyncSession, city_name:str):
+    # 相当于SQL: SELECT * FROM city WHERE province = city_name
+    return await db.scalar(select(models.City).where(models.City.province == city_name))
+
+
+async def get_cities(db:AsyncSession, skip:int=0, limit:int=10, after:str=None):
+    return (await db.scalars(select_cities(skip=skip, limit=limit, after=after))).all()
+
+
+async def get_data(db:AsyncSession, city:str=None, skip:int=0, limit:int=10, after:str=None, load_city:str=None):
+    """参数含义见crud.get_data。异步会话不能懒加载，要访问d.city必须传load_city"""
+    stmt = select_data(city=city, skip=skip, limit=limit, after=after, load_city=load_city)
+    return (await db.scalars(stmt)).all()
+
+
+async def stream_export(db:AsyncSession, city:str=None, start:date=None, end:date=None, batch_size:int=1000):
+    """
+    用服务端游标分批读取导出数据，每次yield最多batch_size行（元组），
+    不会把整张表一次性读进内存，第一批取到就可以开始往外发送
+    """
+    stmt = select_export(city=city, start=start, end=end).execution_options(yield_per=batch_size)
+    result = await db.stream(stmt)
+    async for rows in result.partitions():
+        yield rows
+
+
+async def get_city_summaries(db:AsyncSession, city:str=None):
+    return (await db.scalars(select_city_summaries(city=city))).all()
+
+
+async def get_national_daily(db:AsyncSession, start:date=None, end:date=None, latest:bool=False):
+    return (await db.scalars(select_national_daily(start=start, end=end, latest=latest))).all()
@@ -0,0 +1,174 @@
+"""
+只读接口的进程内响应缓存（LRU淘汰 + TTL过期）和数据集版本号
+
+数据只有在同步（bg_task）或create_*接口写入时才会变，所以缓存以路由+查询参数为键，
+写入后调用data_changed()让缓存整体失效并递增数据集版本号。hits/misses计数用于评估缓存大小是否合适。
+数据集版本号存在数据库里，多个worker进程共用，用来生成ETag/Last-Modified，支持条件请求（304 Not Modified）。
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Any, Hashable, Optional
+
+from fastapi.requests import Request
+from sqlalchemy import func, select, update
+from sqlalchemy.engine import Engine
+
+from covid19 import models
+from covid19.database import engine
+from covid19.settings import settings
+
+
+class TTLCache:
+    """线程安全的LRU缓存，条目超过ttl秒过期，条目数超过maxsize时淘汰最久未使用的"""
+
+    def __init__(self, maxsize:int=256, ttl:float=300.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._items = OrderedDict()  # key -> (过期时间, value)，越靠后越是最近使用的
+        self._lock = threading.Lock()   # 同步接口和后台任务跑在线程池里，需要加锁
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.generation = 0     # 每次invalidate加1；读之前记下来，写缓存时对不上说明期间数据变过
+
+    def get(self, key:Hashable) -> Optional[Any]:
+        with self._lock:
+            item = self._items.get(key)
+            if item is None or item[0] < time.monotonic():
+                if item is not None:
+                    del self._items[key]
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def set(self, key:Hashable, value:Any, generation:int=None):
+        """generation是开始读数据时的self.generation；读的过程中缓存被invalidate过，读到的可能是旧数据，不写入"""
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            self._items[key] = (time.monotonic() + self.ttl, value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def invalidate(self):
+        with self._lock:
+            self._items.clear()
+            self.invalidations += 1
+            self.generation += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self._items),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+                'invalidations': self.invalidations,
+            }
+
+
+def cache_key(request:Request) -> tuple:
+    """路由路径 + 排好序的查询参数，参数顺序不同的同一个请求命中同一条缓存"""
+    return request.url.path, tuple(sorted(request.query_params.multi_items()))
+
+
+response_cache = TTLCache(maxsize=settings.cache_maxsize, ttl=settings.cache_ttl)
+
+
+class DatasetVersion:
+    """
+    数据集版本：保存在数据库的dataset_version表里（models.DatasetState），每次写入后generation加1并记录修改时间。
+    多个worker进程用的是同一个数据库，一个进程写入后，其他进程最多poll秒后读到新版本，
+    同时清空自己的响应缓存，所以不会一直返回旧的304和旧的缓存内容。
+    """
+
+    def __init__(self, engine:Engine=None, cache:TTLCache=None, poll:float=1.0):
+        self.engine = engine
+        self.cache = cache
+        self.poll = poll
+        self._lock = threading.Lock()
+        self._checked = None        # 上次读版本号的time.monotonic()
+        self.generation = None
+        self.last_modified = None
+
+    def _read(self, conn):
+        table = models.DatasetState.__table__
+        return conn.execute(select(table.c.generation, table.c.modified).where(table.c.id == 1)).first()
+
+    def due(self) -> bool:
+        """距离上次读取版本号是否已经超过poll秒，异步接口据此决定要不要到线程池里refresh"""
+        return self._checked is None or time.monotonic() - self._checked >= self.poll
+
+    def refresh(self, force:bool=False):
+        """
+        距离上次读取超过poll秒（或force）时重新读版本号，版本变了就清空本进程的响应缓存。
+        这是阻塞的数据库查询，异步接口里要用run_in_threadpool调用。这一行由migrations.upgrade_schema插入，这里只读
+        """
+        if not force and not self.due():
+            return
+        now = time.monotonic()
+        with self.engine.connect() as conn:
+            row = self._read(conn)
+        if row is None:
+            raise RuntimeError('dataset_version表里没有数据集版本号，请先运行 python -m covid19.migrations')
+        generation, modified = row
+        with self._lock:
+            if self.generation is not None and generation != self.generation and self.cache is not None:
+                self.cache.invalidate()     # 别的进程写入了
+            self.generation = generation
+            self.last_modified = datetime.fromtimestamp(modified, timezone.utc)   # HTTP日期只精确到秒
+            self._checked = now
+
+    def bump(self):
+        # 一条UPDATE完成加1，多个进程同时写入也不会丢；同一秒内多次写入时也要让Last-Modified前进，
+        # 否则If-Modified-Since会误判为未修改
+        table = models.DatasetState.__table__
+        with self.engine.begin() as conn:
+            conn.execute(update(table).where(table.c.id == 1).values(
+                generation=table.c.generation + 1, modified=func.max(int(time.time()), table.c.modified + 1)))
+        self.refresh(force=True)
+
+    @property
+    def etag(self) -> str:
+        """用的是上次refresh读到的版本号，不查库；每个请求开始时先refresh（见main.cached_response）"""
+        if self.generation is None:
+            self.refresh()
+        return f'W/"{self.generation}-{int(self.last_modified.timestamp())}"'
+
+    def headers(self) -> dict:
+        etag = self.etag
+        return {'ETag': etag, 'Last-Modified': format_datetime(self.last_modified, usegmt=True)}
+
+    def not_modified(self, request:Request) -> bool:
+        """按If-None-Match优先、If-Modified-Since其次的规则判断客户端的缓存是否仍然有效"""
+        etag = self.etag
+        if_none_match = request.headers.get('if-none-match')
+        if if_none_match is not None:
+            tags = [tag.strip() for tag in if_none_match.split(',')]
+            return '*' in tags or etag in tags or etag[2:] in tags  # 弱比较，不区分W/前缀
+        if_modified_since = request.headers.get('if-modified-since')
+        if if_modified_since is not None:
+            try:
+                return self.last_modified <= parsedate_to_datetime(if_modified_since)
+            except (TypeError, ValueError):
+                return False
+        return False
+
+
+dataset_version = DatasetVersion(engine, response_cache, poll=settings.dataset_version_poll)
+
+
+def data_changed():
+    """数据写入（提交）后调用：读接口的缓存全部失效，数据库里的数据集版本号递增，其他进程据此失效各自的缓存"""
+    response_cache.invalidate()
+    dataset_version.bump()
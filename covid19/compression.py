@@ -0,0 +1,136 @@
+"""
+响应压缩中间件（gzip/brotli），主要给/get_data、/cities、/export这类大的JSON/NDJSON/CSV响应用
+
+和Starlette自带的GZipMiddleware相比：
+- 客户端支持时优先用brotli（安装了brotli的话），gzip和brotli的压缩级别都可以配置
+- 只压缩白名单里的Content-Type，小于minimum_size的响应不压缩（压缩小响应得不偿失）
+- 已经带Content-Encoding的响应（例如assets.py发送的预压缩静态文件）原样发送
+- 流式响应（StreamingResponse）逐块压缩并立即flush，不会等整个响应生成完
+- 大于offload_size的响应体放到线程池里压缩，不阻塞事件循环
+"""
+
+import zlib
+
+import anyio
+from starlette.datastructures import Headers, MutableHeaders
+
+from covid19.assets import accepted_encodings
+
+try:
+    import brotli
+except ImportError:     # brotli是可选依赖，没有安装时只用gzip
+    brotli = None
+
+COMPRESSIBLE_TYPES = (
+    'application/json', 'application/x-ndjson', 'application/javascript', 'image/svg+xml',
+    'text/html', 'text/csv', 'text/plain', 'text/css', 'text/javascript',
+)
+
+
+class GzipCompressor:
+    encoding = 'gzip'
+
+    def __init__(self, level:int):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)    # wbits=31：带gzip头和校验
+
+    def compress(self, data:bytes, last:bool) -> bytes:
+        # 不是最后一块时用Z_SYNC_FLUSH，把已经压缩的数据全部输出，客户端可以立即解压
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+
+class BrotliCompressor:
+    encoding = 'br'
+
+    def __init__(self, quality:int):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data:bytes, last:bool) -> bytes:
+        output = self._compressor.process(data)
+        return output + (self._compressor.finish() if last else self._compressor.flush())
+
+
+class CompressionMiddleware:
+    """纯ASGI中间件（不用BaseHTTPMiddleware，它会把流式响应整个读进内存）"""
+
+    def __init__(self, app, minimum_size:int=1024, gzip_level:int=6, brotli_quality:int=4,
+                 offload_size:int=256 * 1024, compressible_types=COMPRESSIBLE_TYPES):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality      # 动态内容用4左右，压缩率接近gzip -9，速度快得多；11只适合构建时预压缩
+        self.offload_size = offload_size
+        self.compressible_types = tuple(compressible_types)
+
+    def new_compressor(self, scope):
+        accepted = accepted_encodings(Headers(scope=scope).get('accept-encoding', ''))
+        if 'br' in accepted and brotli is not None:
+            return BrotliCompressor(self.brotli_quality)
+        if 'gzip' in accepted:
+            return GzipCompressor(self.gzip_level)
+        return None
+
+    def compressible(self, status:int, headers:Headers) -> bool:
+        content_type = headers.get('content-type', '').split(';')[0].strip().lower()
+        return (status not in (204, 206, 304) and 'content-encoding' not in headers
+                and content_type.startswith(self.compressible_types))
+
+    async def compress(self, compressor, data:bytes, last:bool) -> bytes:
+        if len(data) >= self.offload_size:
+            return await anyio.to_thread.run_sync(compressor.compress, data, last)
+        return compressor.compress(data, last)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['method'] == 'HEAD':
+            await self.app(scope, receive, send)
+            return
+        compressor = self.new_compressor(scope)
+        if compressor is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None    # 响应头先留着，看到第一块响应体才知道要不要压缩
+        compressing = False
+
+        async def compressing_send(message):
+            nonlocal start_message, compressing
+            if message['type'] == 'http.response.start':
+                start_message = message
+                return
+            if message['type'] != 'http.response.body':
+                await send(message)
+                return
+
+            body, more_body = message.get('body', b''), message.get('more_body', False)
+            if start_message is not None:
+                headers = MutableHeaders(raw=start_message['headers'])
+                if (not self.compressible(start_message['status'], headers)
+                        or (not more_body and len(body) < self.minimum_size)):
+                    await send(start_message)
+                    start_message = None
+                    await send(message)
+                    return
+                compressing = True
+                headers['Content-Encoding'] = compressor.encoding
+                headers.add_vary_header('Accept-Encoding')
+                if headers.get('etag', '').startswith('"'):    # 压缩后字节不同了，强ETag改成弱ETag
+                    headers['ETag'] = 'W/' + headers['etag']
+                if more_body:       # 流式响应不知道压缩后的长度，用chunked传输
+                    del headers['Content-Length']
+                else:
+                    body = await self.compress(compressor, body, last=True)
+                    headers['Content-Length'] = str(len(body))
+                    await send(start_message)
+                    start_message = None
+                    await send({'type': 'http.response.body', 'body': body})
+                    return
+                await send(start_message)
+                start_message = None
+            elif not compressing:
+                await send(message)
+                return
+
+            data = await self.compress(compressor, body, last=not more_body)
+            if data or not more_body:
+                await send({'type': 'http.response.body', 'body': data, 'more_body': more_body})
+
+        await self.app(scope, receive, compressing_send)
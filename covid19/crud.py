@@ -1,4 +1,13 @@
-from sqlalchemy.orm import Session
+import base64
+import binascii
+import json
+from datetime import date
+from itertools import islice
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from pydantic import TypeAdapter
+from sqlalchemy import Select, delete, func, insert, select, update
+from sqlalchemy.orm import Session, joinedload, selectinload
 from covid19 import models, schemas
 
 
@@ -8,12 +17,43 @@ def get_city(db:Session, city_id:int):
 
 
 def get_city_by_name(db:Session, city_name:str):
-    # 相当于SQL: SELECT * FROM city WHERE name = city_name
-    return db.query(models.City).filter(models.City.name == city_name).first()
+    # 相当于SQL: SELECT * FROM city WHERE province = city_name
+    return db.query(models.City).filter(models.City.province == city_name).first()
+
+def encode_cursor(key:dict) -> str:
+    """把排序键编码成不透明的游标字符串，客户端原样传回即可"""
+    return base64.urlsafe_b64encode(json.dumps(key, default=str).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor:str, field:str):
+    """解析游标，取出field对应的排序键；游标无效时抛出ValueError"""
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        value = key[field]
+        return date.fromisoformat(value) if field == 'date' else int(value)
+    except (binascii.Error, UnicodeDecodeError, TypeError, KeyError, ValueError) as e:
+        raise ValueError(f'Invalid cursor: {cursor}') from e
+
+
+def next_cursor(rows:list, limit:int, field:str) -> Optional[str]:
+    """本页取满了limit条才可能还有下一页，用最后一行的排序键生成下一页的游标"""
+    if limit and len(rows) == limit:
+        return encode_cursor({field: getattr(rows[-1], field)})
+    return None
+
+
+def select_cities(skip:int=0, limit:int=10, after:Optional[str]=None) -> Select:
+    """get_cities的查询语句，同步和异步（async_crud.py）共用"""
+    stmt = select(models.City).order_by(models.City.id)
+    if after:   # 游标分页：从上一页最后一个id往后取，走主键索引，第N页和第1页一样快
+        # 相当于SQL: SELECT * FROM city WHERE id > after ORDER BY id LIMIT limit
+        return stmt.where(models.City.id > decode_cursor(after, 'id')).limit(limit)
+    # 相当于SQL: SELECT * FROM city ORDER BY id LIMIT limit OFFSET skip
+    return stmt.offset(skip).limit(limit)
+
 
-def get_cities(db:Session, skip:int=0, limit:int=10):
-    # 相当于SQL: SELECT * FROM city LIMIT limit OFFSET skip
-    return db.query(models.City).offset(skip).limit(limit).all()
+def get_cities(db:Session, skip:int=0, limit:int=10, after:Optional[str]=None):
+    return db.scalars(select_cities(skip=skip, limit=limit, after=after)).all()
 
 
 def create_city(db:Session, city:schemas.CreateCity):
@@ -25,20 +65,314 @@ def create_city(db:Session, city:schemas.CreateCity):
     return db_city
 
 
-def get_data(db:Session, city:str=None, skip:int=0, limit:int=10):
+# Data.city默认是懒加载，逐行访问d.city会每行多发一条SELECT（N+1问题），需要时用这两种方式预先加载
+CITY_LOADERS = {
+    'joined': joinedload,       # LEFT OUTER JOIN city，一条SQL取回数据和城市
+    'selectin': selectinload,   # 先取数据，再用一条 SELECT ... WHERE city.id IN (...) 取回城市
+}
+
+
+def select_data(city:str=None, skip:int=0, limit:int=10, after:Optional[str]=None, load_city:Optional[str]=None) -> Select:
+    """get_data的查询语句，同步和异步（async_crud.py）共用，参数含义见get_data"""
+    if load_city is not None and load_city not in CITY_LOADERS:
+        raise ValueError(f'Invalid load_city: {load_city}')
+    stmt = select(models.Data)
+    if load_city:
+        stmt = stmt.options(CITY_LOADERS[load_city](models.Data.city))
     if city:    # 按照城市名字查询
-        # 相当于SQL: SELECT * FROM data WHERE city.province = city
-        return db.query(models.Data).filter(models.Data.city.has(province=city))   # 外键关联查询，这里不是像Django ORM那样Data.city.province
+        # 相当于SQL: SELECT * FROM data WHERE city_id = (SELECT id FROM city WHERE province = city) ORDER BY date
+        # 先用province的唯一索引找到city_id，再走(city_id, date)索引；不用Data.city.has()，它会对data全表扫描
+        city_id = select(models.City.id).where(models.City.province == city).scalar_subquery()
+        stmt = stmt.where(models.Data.city_id == city_id).order_by(models.Data.date)
+        if after is not None:   # 兼容老接口：按城市查询默认返回全部数据，传after=''从第一页开始按游标分页
+            if after:
+                # 相当于SQL: ... AND date > after ORDER BY date LIMIT limit
+                stmt = stmt.where(models.Data.date > decode_cursor(after, 'date'))
+            return stmt.limit(limit)
+        return stmt
     # 没有城市名字就分页查询
-    # 相当于SQL: SELECT * FROM data LIMIT limit OFFSET skip
-    return db.query(models.Data).offset(skip).limit(limit).all()
+    stmt = stmt.order_by(models.Data.id)
+    if after:
+        # 相当于SQL: SELECT * FROM data WHERE id > after ORDER BY id LIMIT limit
+        return stmt.where(models.Data.id > decode_cursor(after, 'id')).limit(limit)
+    # 相当于SQL: SELECT * FROM data ORDER BY id LIMIT limit OFFSET skip
+    return stmt.offset(skip).limit(limit)
+
+
+def get_data(db:Session, city:str=None, skip:int=0, limit:int=10, after:Optional[str]=None, load_city:Optional[str]=None):
+    """
+    after是上一页返回的游标（见next_cursor），传了after就按游标分页，忽略skip。
+    按城市查询时按date排序、游标是日期，after=''表示从第一页开始；否则按id排序、游标是id。
+    load_city是CITY_LOADERS里的'joined'或'selectin'，需要访问d.city时传入，查询次数不再随行数增长。
+    """
+    return db.scalars(select_data(city=city, skip=skip, limit=limit, after=after, load_city=load_city)).all()
+
+
+
+def select_data_page(city:str=None, skip:int=0, limit:int=100) -> Select:
+    """首页表格的一页数据：带上城市（JOIN），按城市查询时也按skip/limit分页"""
+    stmt = select_data(city=city, skip=skip, limit=limit, load_city='joined')
+    return stmt.offset(skip).limit(limit) if city else stmt
+
 
+def stream_data_page(db:Session, city:str=None, skip:int=0, limit:int=100, batch_size:int=200):
+    """
+    select_data_page的惰性版本：第一次迭代时才执行查询，之后每次从游标取batch_size行，
+    整页数据不会同时放在内存里。迭代结束之前会话不能关闭。
+    """
+    yield from db.scalars(select_data_page(city=city, skip=skip, limit=limit).execution_options(yield_per=batch_size))
+
+
+# 导出接口输出的列，顺序即CSV的表头顺序
+EXPORT_COLUMNS = ('province', 'date', 'confirmed', 'deaths', 'recovered')
+
+
+def select_export(city:str=None, start:date=None, end:date=None) -> Select:
+    """
+    导出用的查询，只取需要的列（不实例化ORM对象），按(city_id, date)排序走索引。
+    相当于SQL: SELECT city.province, data.date, ... FROM data JOIN city ON ... WHERE ... ORDER BY data.city_id, data.date
+    """
+    stmt = (select(models.City.province, models.Data.date, models.Data.confirmed, models.Data.deaths, models.Data.recovered)
+            .join(models.City, models.Data.city_id == models.City.id)
+            .order_by(models.Data.city_id, models.Data.date))
+    if city:
+        stmt = stmt.where(models.City.province == city)
+    if start:
+        stmt = stmt.where(models.Data.date >= start)
+    if end:
+        stmt = stmt.where(models.Data.date <= end)
+    return stmt
+
+
+def get_data_range(db:Session, city:str, start:date=None, end:date=None):
+    """某城市[start, end]（含首尾）内的数据，只取需要的列，走(city_id, date)索引"""
+    stmt = (select(models.Data.date, models.Data.confirmed, models.Data.deaths, models.Data.recovered)
+            .join(models.City, models.Data.city_id == models.City.id)
+            .where(models.City.province == city)
+            .order_by(models.Data.date))
+    if start:
+        stmt = stmt.where(models.Data.date >= start)
+    if end:
+        stmt = stmt.where(models.Data.date <= end)
+    return db.execute(stmt).all()
 
 
 def create_city_data(db:Session, data:schemas.CreateData, city_id:int):
+    db_data = add_city_data(db, data=data, city_id=city_id)
+    db.commit()
+    db.refresh(db_data)
+    return db_data
+
+
+def add_city_data(db:Session, data:schemas.CreateData, city_id:int):
+    """只INSERT（flush）不提交，由调用方和其他修改（例如refresh_rollups）在同一个事务里提交"""
     # 相当于SQL: INSERT INTO data (city_id, date, confirmed, deaths, recovered) VALUES (city_id, data.date, data.confirmed, data.deaths, data.recovered)
     db_data = models.Data(**data.model_dump(), city_id=city_id)
     db.add(db_data)
-    db.commit()
-    db.refresh(db_data)
-    return db_data
\ No newline at end of file
+    db.flush()
+    return db_data
+
+
+
+'''--------------- 批量写入（同步数据用） ---------------'''
+
+# 对整个列表只做一次校验，比逐行实例化Pydantic模型快得多
+CITY_LIST_ADAPTER = TypeAdapter(List[schemas.CreateCity])
+DATA_LIST_ADAPTER = TypeAdapter(List[schemas.CreateData])
+
+
+def _chunked(rows:Iterable[dict], size:int):
+    """把rows按size切成若干块，每块是一个list"""
+    it = iter(rows)
+    while chunk := list(islice(it, size)):
+        yield chunk
+
+
+def bulk_create_cities(db:Session, cities:List[dict], chunk_size:int=500) -> int:
+    """
+    批量插入城市，不commit也不refresh，由调用方在同一个事务里统一提交。
+    相当于SQL: INSERT INTO city (...) VALUES (...), (...), ...
+    """
+    rows = CITY_LIST_ADAPTER.dump_python(CITY_LIST_ADAPTER.validate_python(cities))
+    for chunk in _chunked(rows, chunk_size):
+        db.execute(insert(models.City), chunk)
+    return len(rows)
+
+
+def get_city_ids(db:Session) -> Dict[str, int]:
+    """一次查询取得 {province: id} 的映射，代替逐个调用get_city_by_name"""
+    # 相当于SQL: SELECT province, id FROM city
+    return dict(db.execute(select(models.City.province, models.City.id)).all())
+
+
+def bulk_create_city_data(db:Session, data:List[dict], city_ids:List[int], chunk_size:int=1000) -> int:
+    """
+    批量插入数据，data[i]属于city_ids[i]这个城市，同样不commit也不refresh。
+    相当于SQL: INSERT INTO data (city_id, date, confirmed, deaths, recovered) VALUES (...), (...), ...
+    """
+    rows = DATA_LIST_ADAPTER.dump_python(DATA_LIST_ADAPTER.validate_python(data))
+    for row, city_id in zip(rows, city_ids):
+        row['city_id'] = city_id
+    for chunk in _chunked(rows, chunk_size):
+        db.execute(insert(models.Data), chunk)
+    return len(rows)
+
+
+def upsert_cities(db:Session, cities:List[dict], chunk_size:int=500) -> Tuple[int, int]:
+    """
+    按province增量同步城市：只插入新城市，只更新字段有变化的城市，没变的不动。
+    返回 (插入行数, 更新行数)，同样不commit。
+    """
+    rows = CITY_LIST_ADAPTER.dump_python(CITY_LIST_ADAPTER.validate_python(cities))
+    columns = ('country', 'country_code', 'country_population')
+    existing = {
+        province: (city_id, rest)
+        for province, city_id, *rest in db.execute(select(
+            models.City.province, models.City.id, *(getattr(models.City, c) for c in columns)))
+    }
+    new_rows, changed_rows = [], []
+    for row in rows:
+        if row['province'] not in existing:
+            new_rows.append(row)
+            continue
+        city_id, old = existing[row['province']]
+        if [row[c] for c in columns] != old:
+            changed_rows.append({'id': city_id, **{c: row[c] for c in columns}})
+    for chunk in _chunked(new_rows, chunk_size):
+        db.execute(insert(models.City), chunk)
+    for chunk in _chunked(changed_rows, chunk_size):
+        db.execute(update(models.City), chunk)     # 按主键批量UPDATE
+    return len(new_rows), len(changed_rows)
+
+
+def upsert_city_data(db:Session, data:List[dict], city_ids:List[int], chunk_size:int=1000) -> Tuple[int, int]:
+    """
+    按(city_id, date)增量同步数据：只插入新的日期，只更新数量有变化的行，
+    没变的行连同它的id和created_at都保持原样。返回 (插入行数, 更新行数)，同样不commit。
+    """
+    rows = DATA_LIST_ADAPTER.dump_python(DATA_LIST_ADAPTER.validate_python(data))
+    return upsert_data_rows(db, rows, city_ids, chunk_size=chunk_size)
+
+
+def upsert_data_rows(db:Session, rows:List[dict], city_ids:List[int], chunk_size:int=1000) -> Tuple[int, int]:
+    """upsert_city_data的后半部分，rows是已经校验过的dict（批量写入接口自己校验），会就地加上city_id"""
+    columns = ('confirmed', 'deaths', 'recovered')
+    # 只取比较需要的几列，不做ORM对象的实例化；只查本批涉及的城市，走(city_id, date)索引
+    existing = {
+        (city_id, date): (data_id, rest)
+        for data_id, city_id, date, *rest in db.execute(select(
+            models.Data.id, models.Data.city_id, models.Data.date, *(getattr(models.Data, c) for c in columns))
+            .where(models.Data.city_id.in_(set(city_ids))))
+    }
+    new_rows, changed_rows = [], []
+    for row, city_id in zip(rows, city_ids):
+        row['city_id'] = city_id
+        key = (city_id, row['date'])
+        if key not in existing:
+            new_rows.append(row)
+            continue
+        data_id, old = existing[key]
+        if [row[c] for c in columns] != old:
+            changed_rows.append({'id': data_id, **{c: row[c] for c in columns}})
+    for chunk in _chunked(new_rows, chunk_size):
+        db.execute(insert(models.Data), chunk)
+    for chunk in _chunked(changed_rows, chunk_size):
+        db.execute(update(models.Data), chunk)
+    return len(new_rows), len(changed_rows)
+
+'''----------------------------------------------------------'''
+
+
+
+'''--------------- 汇总表（每次写入数据后刷新） ---------------'''
+
+ROLLUP_COLUMNS = ('date', 'confirmed', 'deaths', 'recovered', 'new_confirmed', 'new_deaths')
+
+
+def _select_city_summary(city_id:Optional[int]=None) -> Select:
+    """用窗口函数算出每个城市最新一天的累计数，以及它和前一天的差值（当天新增）"""
+    by_date = dict(partition_by=models.Data.city_id, order_by=models.Data.date)
+    ranked = select(
+        models.Data.city_id, models.Data.date, models.Data.confirmed, models.Data.deaths, models.Data.recovered,
+        (models.Data.confirmed - func.lag(models.Data.confirmed, 1, 0).over(**by_date)).label('new_confirmed'),
+        (models.Data.deaths - func.lag(models.Data.deaths, 1, 0).over(**by_date)).label('new_deaths'),
+        func.row_number().over(partition_by=models.Data.city_id, order_by=models.Data.date.desc()).label('rn'),
+    )
+    if city_id is not None:
+        ranked = ranked.where(models.Data.city_id == city_id)
+    ranked = ranked.subquery()
+    return (select(ranked.c.city_id, models.City.province, *(ranked.c[c] for c in ROLLUP_COLUMNS))
+            .join(models.City, models.City.id == ranked.c.city_id)
+            .where(ranked.c.rn == 1))
+
+
+def _select_national_daily(since:Optional[date]=None) -> Select:
+    """按日期汇总全国累计数，再用窗口函数算每天新增；传了since只计算since及之后的日期"""
+    totals = select(
+        models.Data.date,
+        func.sum(models.Data.confirmed).label('confirmed'),
+        func.sum(models.Data.deaths).label('deaths'),
+        func.sum(models.Data.recovered).label('recovered'),
+    ).group_by(models.Data.date)
+    if since is not None:
+        # 算since当天的新增需要前一个有数据的日期，所以从那一天开始汇总，走date索引
+        previous = select(func.max(models.Data.date)).where(models.Data.date < since).scalar_subquery()
+        totals = totals.where(models.Data.date >= func.coalesce(previous, since))
+    totals = totals.subquery()
+    daily = select(
+        totals.c.date, totals.c.confirmed, totals.c.deaths, totals.c.recovered,
+        (totals.c.confirmed - func.lag(totals.c.confirmed, 1, 0).over(order_by=totals.c.date)).label('new_confirmed'),
+        (totals.c.deaths - func.lag(totals.c.deaths, 1, 0).over(order_by=totals.c.date)).label('new_deaths'),
+    ).subquery()
+    stmt = select(*(daily.c[c] for c in ROLLUP_COLUMNS))
+    if since is not None:
+        stmt = stmt.where(daily.c.date >= since)
+    return stmt
+
+
+def refresh_rollups(db:Session, city_id:Optional[int]=None, since:Optional[date]=None):
+    """
+    在数据库里用INSERT ... SELECT重新计算汇总表，不把数据取回Python，不commit。
+    不传参数时全量重算（同步之后）；create_data之类只改了一个城市某一天的数据时，
+    传city_id和since只重算这个城市的汇总行和since之后的全国数据。
+    """
+    summary_columns = ('city_id', 'province', *ROLLUP_COLUMNS)
+    summary = delete(models.CitySummary)
+    national = delete(models.NationalDaily)
+    if city_id is not None:
+        summary = summary.where(models.CitySummary.city_id == city_id)
+    if since is not None:
+        national = national.where(models.NationalDaily.date >= since)
+    db.execute(summary)
+    db.execute(national)
+    db.execute(insert(models.CitySummary).from_select(summary_columns, _select_city_summary(city_id)))
+    db.execute(insert(models.NationalDaily).from_select(ROLLUP_COLUMNS, _select_national_daily(since)))
+
+
+def select_city_summaries(city:str=None) -> Select:
+    stmt = select(models.CitySummary).order_by(models.CitySummary.city_id)
+    if city:
+        stmt = stmt.where(models.CitySummary.province == city)
+    return stmt
+
+
+def select_national_daily(start:date=None, end:date=None, latest:bool=False) -> Select:
+    """latest=True时只取最新一天，走主键倒序取第一行"""
+    if latest:
+        return select(models.NationalDaily).order_by(models.NationalDaily.date.desc()).limit(1)
+    stmt = select(models.NationalDaily).order_by(models.NationalDaily.date)
+    if start:
+        stmt = stmt.where(models.NationalDaily.date >= start)
+    if end:
+        stmt = stmt.where(models.NationalDaily.date <= end)
+    return stmt
+
+
+def get_city_summaries(db:Session, city:str=None):
+    return db.scalars(select_city_summaries(city=city)).all()
+
+
+def get_national_daily(db:Session, start:date=None, end:date=None, latest:bool=False):
+    return db.scalars(select_national_daily(start=start, end=end, latest=latest)).all()
+
+'''----------------------------------------------------------'''
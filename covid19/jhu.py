@@ -0,0 +1,116 @@
+"""
+coronavirus-tracker-api（JHU数据源）的HTTP客户端
+
+- 一个带连接池的httpx.Client，两次请求复用连接，设置超时
+- 连接失败、超时和5xx响应按指数退避重试
+- timelines=true的响应体很大，用ijson边下载边解析，每解析完一个location就交给调用方，
+  不把整个JSON文档读进内存
+"""
+
+import logging
+import time
+from contextlib import contextmanager
+from typing import Iterator, List, Optional
+
+import httpx
+import ijson
+
+
+logger = logging.getLogger(__name__)
+
+JHU_URL = 'https://coronavirus-tracker-api.herokuapp.com/v2/locations'
+
+
+class _ByteStream:
+    """把httpx的iter_bytes()包装成ijson需要的带read()方法的文件对象"""
+
+    def __init__(self, chunks:Iterator[bytes]):
+        self._chunks = chunks
+        self._buffer = b''
+
+    def read(self, size:int=-1) -> bytes:
+        while size < 0 or len(self._buffer) < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            self._buffer += chunk
+        if size < 0:
+            data, self._buffer = self._buffer, b''
+        else:
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+
+class JHUClient:
+    """
+    :param url: 接口地址
+    :param timeout: 连接/读取超时（秒），读取超时是指两次收到数据之间的间隔，不是整个下载的时间
+    :param retries: 失败后最多重试几次
+    :param backoff: 第n次重试前等待 backoff * 2 ** (n - 1) 秒
+    :param transport: 测试时传入httpx.MockTransport
+    """
+
+    def __init__(self, url:str=JHU_URL, timeout:float=30.0, retries:int=3, backoff:float=0.5,
+                 transport:Optional[httpx.BaseTransport]=None):
+        self.url = str(url)
+        self.retries = retries
+        self.backoff = backoff
+        self.client = httpx.Client(
+            timeout=httpx.Timeout(timeout),
+            limits=httpx.Limits(max_connections=4, max_keepalive_connections=2),
+            transport=transport,
+        )
+
+    def close(self):
+        self.client.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _send(self, timelines:bool) -> httpx.Response:
+        """发送请求（不读取响应体），连接失败、超时、5xx时重试，返回最后一次的响应"""
+        params = {'source': 'jhu', 'country_code': 'CN', 'timelines': str(timelines).lower()}
+        request = self.client.build_request('GET', self.url, params=params)
+        for attempt in range(self.retries + 1):
+            try:
+                response = self.client.send(request, stream=True)
+            except httpx.TransportError as e:
+                if attempt == self.retries:
+                    raise
+                logger.warning('请求%s失败（%r），准备第%d次重试', request.url, e, attempt + 1)
+            else:
+                if response.status_code < 500 or attempt == self.retries:
+                    return response
+                response.close()
+                logger.warning('请求%s返回%d，准备第%d次重试', request.url, response.status_code, attempt + 1)
+            time.sleep(self.backoff * 2 ** attempt)
+
+    def fetch_cities(self) -> Optional[List[dict]]:
+        """timelines=false，体积很小，直接整体解析；返回locations，请求失败返回None"""
+        response = self._send(timelines=False)
+        try:
+            if response.status_code != 200:
+                return None
+            response.read()
+            return response.json()['locations']
+        finally:
+            response.close()
+
+    @contextmanager
+    def stream_locations(self) -> Iterator[Optional[Iterator[dict]]]:
+        """
+        timelines=true，边下载边解析，逐个yield location；请求失败时上下文的值是None
+        用法：with client.stream_locations() as locations: for location in locations: ...
+        """
+        response = self._send(timelines=True)
+        try:
+            if response.status_code != 200:
+                yield None
+            else:
+                # use_float=True：数字直接解析成int/float，不要Decimal
+                yield ijson.items(_ByteStream(response.iter_bytes()), 'locations.item', use_float=True)
+        finally:
+            response.close()
@@ -0,0 +1,126 @@
+"""
+同步任务管理：同一时间只运行一个同步任务
+
+重复点击“同步数据”时不会再排队一个新的bg_task，而是合并到正在运行的任务上，返回同一个任务ID。
+每个任务记录阶段、已处理行数、耗时和吞吐量，供状态接口查询。
+后台任务没有执行（客户端断开、进程退出）或者卡住时，超过timeout秒没有进度的任务视为已经失败，不再挡住新的同步。
+"""
+
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Callable, Optional, Tuple
+
+from covid19.settings import settings
+
+
+class SyncJob:
+    """一次同步任务的状态。phase依次是queued -> running阶段 -> done或failed"""
+
+    def __init__(self, incremental:bool=False):
+        self.id = uuid.uuid4().hex
+        self.incremental = incremental
+        self.phase = 'queued'
+        self.rows = 0
+        self.inserted = 0
+        self.updated = 0
+        self.error: Optional[str] = None
+        self.created_at = datetime.now(timezone.utc)
+        self._started: Optional[float] = None
+        self._finished: Optional[float] = None
+        self._last_progress = time.monotonic()     # 创建或最后一次汇报进度的时间，判断任务是否已经死掉
+        self._lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self.phase not in ('done', 'failed')
+
+    def report(self, phase:str, rows:int=0, inserted:int=0, updated:int=0):
+        """bg_task的进度回调：进入新阶段，并累加本阶段处理的行数"""
+        with self._lock:
+            if self._started is None:
+                self._started = time.perf_counter()
+            self._last_progress = time.monotonic()
+            self.phase = phase
+            self.rows += rows
+            self.inserted += inserted
+            self.updated += updated
+
+    def idle(self) -> float:
+        """距离创建或最后一次汇报进度过去的秒数"""
+        with self._lock:
+            return time.monotonic() - self._last_progress
+
+    def finish(self, error:Optional[BaseException]=None):
+        with self._lock:
+            self._finished = time.perf_counter()
+            self.phase = 'failed' if error else 'done'
+            self.error = repr(error) if error else None
+
+    def status(self) -> dict:
+        with self._lock:
+            if self._started is None:
+                elapsed = 0.0
+            else:
+                elapsed = (self._finished or time.perf_counter()) - self._started
+            return {
+                'job_id': self.id,
+                'incremental': self.incremental,
+                'phase': self.phase,
+                'rows': self.rows,
+                'inserted': self.inserted,
+                'updated': self.updated,
+                'elapsed': elapsed,
+                'rows_per_sec': self.rows / elapsed if elapsed else 0.0,
+                'error': self.error,
+                'created_at': self.created_at.isoformat(),
+            }
+
+
+class SyncJobManager:
+    """保证同一时间最多一个同步任务在运行，保留最近history个任务的状态"""
+
+    def __init__(self, history:int=20, timeout:float=1800.0):
+        self.history = history
+        self.timeout = timeout      # 超过这么多秒没有进度的任务视为已经失败
+        self._jobs = OrderedDict()   # job_id -> SyncJob，按创建顺序
+        self._current: Optional[SyncJob] = None
+        self._lock = threading.Lock()
+
+    def start(self, incremental:bool=False) -> Tuple[SyncJob, bool]:
+        """返回(任务, 是否新建)；已有任务在运行时返回它，由调用方决定是否真正执行"""
+        with self._lock:
+            if self._current is not None and self._current.running:
+                if self._current.idle() < self.timeout:
+                    return self._current, False
+                self._current.finish(TimeoutError(f'no progress for {self.timeout:.0f}s'))
+            job = SyncJob(incremental=incremental)
+            self._current = job
+            self._jobs[job.id] = job
+            while len(self._jobs) > self.history:
+                self._jobs.popitem(last=False)
+            return job, True
+
+    def run(self, job:SyncJob, task:Callable, **kwargs):
+        """执行task，task通过progress=job.report汇报进度；无论成功失败（包括被取消）都会结束任务"""
+        error = None
+        try:
+            task(progress=job.report, **kwargs)
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            job.finish(error)
+
+    def get(self, job_id:str) -> Optional[SyncJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def current(self) -> Optional[SyncJob]:
+        with self._lock:
+            return self._current
+
+
+sync_jobs = SyncJobManager(timeout=settings.sync_job_timeout)
@@ -1,27 +1,96 @@
 """        COVID-19 感染数据查询接口         """
 
 
-from fastapi import APIRouter, Depends, HTTPException
+import json
+from contextlib import asynccontextmanager
+from datetime import date
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.routing import APIRoute
+from typing import List
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from covid19 import crud, schemas
-from covid19.database import engine, Base, SessionLocal
+from covid19 import analytics, assets, async_crud, columnar, crud, schemas
+from covid19.cache import cache_key, data_changed, dataset_version, response_cache
+from covid19.columnar import snapshot_store
+from covid19.database import engine, Base, SessionLocal, ReadSessionLocal, async_engines, AsyncSessionLocal
+from covid19.migrations import upgrade_schema
+from covid19.serialization import FastJSONRoute, dump_json
+from covid19.settings import settings
 from covid19.models import City, Data
 
 
-application = APIRouter()
+@asynccontextmanager
+async def lifespan(app):
+    yield
+    # 关闭连接池里的aiosqlite连接，否则它们的工作线程会让进程无法退出
+    for async_engine in async_engines:
+        await async_engine.dispose()
+
+
+# include_router时lifespan会合并到app上；fast_json开启时返回ORM对象的接口用FastJSONRoute直接序列化成JSON字节
+application = APIRouter(lifespan=lifespan, route_class=FastJSONRoute if settings.fast_json else APIRoute)
 
 
 Base.metadata.create_all(bind=engine)
+upgrade_schema(engine)  # create_all不会给已有的表加索引，老数据库在这里原地升级
+
+# 读写分离时只读的请求方法，其余（POST/PUT/DELETE...）都用写库
+READ_METHODS = {'GET', 'HEAD', 'OPTIONS'}
 
-# 公用函数，获取数据库会话
-def get_db():
-    db = SessionLocal()
+
+# 公用函数，获取数据库会话：GET请求用读库，修改数据的请求用写库
+def get_db(request: Request):
+    db = ReadSessionLocal() if request.method in READ_METHODS else SessionLocal()
     try:
         yield db
     finally:
         db.close()
 
 
+# 异步版本，只读接口用它，数据库查询在事件循环里await，不占用线程池
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+# 公用函数，读取/写入响应缓存：缓存的是序列化好的JSON和响应头，命中时不查库也不再序列化
+# 客户端带着仍然有效的If-None-Match/If-Modified-Since来请求时返回304。304只在确定资源存在、要返回200的时候才返回
+# （缓存里只有成功的响应），不存在的城市、错误的游标等照常返回404/400
+def cached_response(request: Request) -> Response:
+    dataset_version.refresh()       # 其他worker写入过时，先清掉本进程的旧缓存
+    return lookup_response_cache(request)
+
+
+# 异步接口用这个：读版本号是阻塞的数据库查询，放到线程池里，不阻塞事件循环；没到poll间隔时不查库，也不进线程池
+async def async_cached_response(request: Request) -> Response:
+    if dataset_version.due():
+        await run_in_threadpool(dataset_version.refresh)
+    return lookup_response_cache(request)
+
+
+def lookup_response_cache(request: Request) -> Response:
+    request.state.cache_generation = response_cache.generation     # 查库之前记下缓存代数，见cache_response
+    cached = response_cache.get(cache_key(request))
+    if cached is not None:
+        content, headers = cached
+        return ok_or_not_modified(request, content, headers)
+
+
+def cache_response(request: Request, response_model, content, headers: dict = None) -> Response:
+    body = dump_json(response_model, content)
+    # 查库期间有写入（data_changed）时不写缓存，否则旧数据会在缓存里再待一个TTL
+    response_cache.set(cache_key(request), (body, headers or {}), generation=getattr(request.state, 'cache_generation', None))
+    return ok_or_not_modified(request, body, headers or {})
+
+
+def ok_or_not_modified(request: Request, body: bytes, headers: dict) -> Response:
+    if dataset_version.not_modified(request):
+        return Response(status_code=304, headers={**headers, **dataset_version.headers()})
+    return Response(content=body, media_type='application/json', headers={**headers, **dataset_version.headers()})
+
+
 '''--------------- 和crud.py里的方法对应 ---------------'''
 
 
@@ -31,40 +100,139 @@ def create_city(city: schemas.CreateCity, db: Session = Depends(get_db)):
     db_city = crud.get_city_by_name(db, city.province)
     if db_city:
         raise HTTPException(status_code=400, detail='City already registered')
-    return crud.create_city(db=db, city=city)
+    db_city = crud.create_city(db=db, city=city)
+    data_changed()      # 数据有变化，读接口的缓存全部失效，数据集版本号递增
+    return db_city
 
 
 
 # 查询城市，根据名称
 @application.get('/city/{city}', response_model=schemas.ReadCity)
-def read_city_by_name(city: str, db: Session = Depends(get_db)):
-    db_city = crud.get_city_by_name(db, city)
+async def read_city_by_name(request: Request, city: str, db: AsyncSession = Depends(get_async_db)):
+    if cached := await async_cached_response(request):
+        return cached
+    db_city = await async_crud.get_city_by_name(db, city)
     if db_city is None:
         raise HTTPException(status_code=404, detail='City not found')
-    return db_city
+    return cache_response(request, schemas.ReadCity, db_city)
+
+
+# 游标分页：下一页的游标放在响应头里，响应体仍然是列表，老的skip/limit调用方不受影响
+NEXT_CURSOR_HEADER = 'X-Next-Cursor'
 
-from typing import List
 
 # 查询多个城市
 @application.get('/cities', response_model=List[schemas.ReadCity])
-def read_cities(skip:int=0, limit:int=10, db: Session = Depends(get_db)):
-    cities = crud.get_cities(db, skip=skip, limit=limit)
-    return cities
+async def read_cities(request: Request, skip:int=0, limit:int=10, after:str=None, db: AsyncSession = Depends(get_async_db)):
+    """after：上一页响应头X-Next-Cursor里的游标，传了就按游标分页，忽略skip"""
+    if cached := await async_cached_response(request):
+        return cached
+    try:
+        cities = await async_crud.get_cities(db, skip=skip, limit=limit, after=after)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    cursor = crud.next_cursor(cities, limit, 'id')
+    return cache_response(request, List[schemas.ReadCity], cities, {NEXT_CURSOR_HEADER: cursor} if cursor else None)
 
 
 # 创建数据
 @application.post('/create_data', response_model=schemas.ReadData)
 def create_data_for_city(city:str, data: schemas.CreateData, db: Session = Depends(get_db)):
     db_city = crud.get_city_by_name(db, city)
-    data = crud.create_data(db=db, data=data, city_id=db_city.id)
+    try:
+        data = crud.add_city_data(db=db, data=data, city_id=db_city.id)
+    except IntegrityError:      # ix_data_city_id_date：同一城市同一天只能有一条
+        db.rollback()
+        raise HTTPException(status_code=409, detail='Data for this city and date already exists')
+    crud.refresh_rollups(db, city_id=db_city.id, since=data.date)   # 只重算这个城市和这一天之后的汇总
+    db.commit()     # 数据和汇总表在同一个事务里提交，和同步（bg_task）一样
+    data_changed()
     return data
 
 
 # 查询数据
 @application.get('/get_data', response_model=List[schemas.ReadData])
-def read_data_for_city(city:str=None, skip:int=0, limit:int=10, db: Session = Depends(get_db)):
-    data = crud.get_data(db, city=city, skip=skip, limit=limit)
-    return data
+async def read_data_for_city(request: Request, city:str=None, skip:int=0, limit:int=10, after:str=None, db: AsyncSession = Depends(get_async_db)):
+    """after：上一页响应头X-Next-Cursor里的游标，传了就按游标分页，忽略skip"""
+    if cached := await async_cached_response(request):
+        return cached
+    try:
+        data = await async_crud.get_data(db, city=city, skip=skip, limit=limit, after=after)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    cursor = None
+    if not (city and after is None):    # 按城市查询且没传after时返回该城市的全部数据，没有下一页
+        cursor = crud.next_cursor(data, limit, 'date' if city else 'id')
+    return cache_response(request, List[schemas.ReadData], data, {NEXT_CURSOR_HEADER: cursor} if cursor else None)
+
+
+# 汇总数据：直接读每次同步后算好的汇总表，不再扫描data表
+@application.get('/summary/cities', response_model=List[schemas.ReadCitySummary])
+async def read_city_summaries(request: Request, db: AsyncSession = Depends(get_async_db)):
+    """每个省/直辖市最新一天的累计数和当天新增数"""
+    if cached := await async_cached_response(request):
+        return cached
+    return cache_response(request, List[schemas.ReadCitySummary], await async_crud.get_city_summaries(db))
+
+
+@application.get('/summary/city/{city}', response_model=schemas.ReadCitySummary)
+async def read_city_summary(request: Request, city: str, db: AsyncSession = Depends(get_async_db)):
+    if cached := await async_cached_response(request):
+        return cached
+    summaries = await async_crud.get_city_summaries(db, city=city)
+    if not summaries:
+        raise HTTPException(status_code=404, detail='City not found')
+    return cache_response(request, schemas.ReadCitySummary, summaries[0])
+
+
+@application.get('/summary/national', response_model=List[schemas.ReadNationalDaily])
+async def read_national_daily(request: Request, start:date=None, end:date=None, db: AsyncSession = Depends(get_async_db)):
+    """全国每天的累计数和新增数，可按日期范围（含首尾）过滤"""
+    if cached := await async_cached_response(request):
+        return cached
+    return cache_response(request, List[schemas.ReadNationalDaily], await async_crud.get_national_daily(db, start=start, end=end))
+
+
+@application.get('/summary/national/latest', response_model=schemas.ReadNationalDaily)
+async def read_national_latest(request: Request, db: AsyncSession = Depends(get_async_db)):
+    if cached := await async_cached_response(request):
+        return cached
+    latest = await async_crud.get_national_daily(db, latest=True)
+    if not latest:
+        raise HTTPException(status_code=404, detail='No data')
+    return cache_response(request, schemas.ReadNationalDaily, latest[0])
+
+
+# 范围查询：某城市某段日期的数据。开启列式快照时从内存数组里二分查找，否则走SQLite
+# 快照按数据集版本号失效，cached_response刚刷新过版本号，其他worker写入以后这里也会重建
+@application.get('/range', response_model=List[schemas.ReadDataPoint])
+def read_data_range(request: Request, city: str, start: date = None, end: date = None, db: Session = Depends(get_db)):
+    if cached := cached_response(request):
+        return cached
+    if columnar.ENABLED:
+        data = snapshot_store.get(db, dataset_version.generation).query(city, start=start, end=end)
+    else:
+        data = crud.get_data_range(db, city=city, start=start, end=end)
+    return cache_response(request, List[schemas.ReadDataPoint], data)
+
+
+# 时间序列分析：服务端用NumPy向量化计算，不需要客户端拉原始数据自己算
+# 计算是CPU密集的，用普通def放到线程池里执行，不阻塞事件循环
+@application.get('/analytics', response_model=List[schemas.ReadCityAnalytics])
+def read_analytics(request: Request, city: List[str] = Query(None), window: int = Query(7, ge=1, le=60),
+                   db: Session = Depends(get_db)):
+    """
+    每日新增、window日移动平均、增长率和翻倍时间。city可以传多个（?city=Hubei&city=Beijing），不传就是所有城市。
+    """
+    if cached := cached_response(request):
+        return cached
+    return cache_response(request, List[schemas.ReadCityAnalytics], analytics.city_analytics(db, provinces=city, window=window))
+
+
+# 响应缓存的命中情况，用来评估缓存大小和过期时间是否合适
+@application.get('/cache_stats')
+def read_cache_stats():
+    return response_cache.stats()
 
 
 '''----------------------------------------------------------'''
@@ -73,57 +241,343 @@ def read_data_for_city(city:str=None, skip:int=0, limit:int=10, db: Session = De
 
 
 
+'''--------------- 数据导出接口 ---------------'''
+
+import csv
+import io
+from typing import Literal
+from fastapi.responses import StreamingResponse
+
+EXPORT_MEDIA_TYPES = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+
+
+def format_ndjson(rows) -> str:
+    return ''.join(json.dumps(dict(zip(crud.EXPORT_COLUMNS, row)), default=str, ensure_ascii=False) + '\n' for row in rows)
+
+
+def format_csv(rows) -> str:
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator='\n').writerows(rows)
+    return buffer.getvalue()
+
+
+# 导出全部数据：逐批从数据库读取、逐批发送，内存占用和表的大小无关
+@application.get('/export')
+async def export_data(format:Literal['ndjson', 'csv']='ndjson', city:str=None, start:date=None, end:date=None,
+                      batch_size:int=Query(1000, ge=1, le=100000), db: AsyncSession = Depends(get_async_db)):
+    """
+    以NDJSON（每行一个JSON对象）或CSV格式流式导出数据，可按城市和日期范围（含首尾）过滤。
+    """
+    formatter = format_ndjson if format == 'ndjson' else format_csv
+
+    async def generate():
+        if format == 'csv':
+            yield format_csv([crud.EXPORT_COLUMNS])     # 表头
+        async for rows in async_crud.stream_export(db, city=city, start=start, end=end, batch_size=batch_size):
+            yield formatter(rows)
+
+    return StreamingResponse(generate(), media_type=EXPORT_MEDIA_TYPES[format], headers={
+        'Content-Disposition': f'attachment; filename="covid19.{format}"',
+    })
+
+
+'''-----------------------------------------------------'''
+
+
+
+
+'''--------------- 批量写入接口 ---------------'''
+
+from typing import Dict, Tuple
+from pydantic import TypeAdapter, ValidationError
+
+# 批量写入数据：一个请求写入多个城市的很多条数据，整批一次校验、一次查城市、一个事务提交
+BULK_ITEMS_ADAPTER = TypeAdapter(List[schemas.CreateCityData])
+NDJSON_MEDIA_TYPES = ('application/x-ndjson', 'application/jsonl')
+
+
+def is_ndjson(content_type: str) -> bool:
+    return content_type.split(';')[0].strip().lower() in NDJSON_MEDIA_TYPES
+
+
+async def read_bulk_body(request: Request, ndjson: bool) -> bytes:
+    """
+    边读边检查大小，不等整个请求体读完：Content-Length或已读字节数超过bulk_max_bytes，
+    或者NDJSON的行数（包括空行）超过bulk_max_items时，立即返回413
+    """
+    too_large = HTTPException(status_code=413, detail=f'Request body too large, at most {settings.bulk_max_bytes} bytes '
+                                                      f'and {settings.bulk_max_items} items')
+    length = request.headers.get('content-length', '')
+    if length.isdigit() and int(length) > settings.bulk_max_bytes:
+        raise too_large
+    chunks, size, lines = [], 0, 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        lines += chunk.count(b'\n') if ndjson else 0
+        if size > settings.bulk_max_bytes or lines > settings.bulk_max_items:
+            raise too_large
+        chunks.append(chunk)
+    return b''.join(chunks)
+
+
+def parse_bulk_body(body: bytes, content_type: str) -> Tuple[list, Dict[int, List[str]]]:
+    """
+    Content-Type是NDJSON时每行一条，解析失败的行记为这一条的错误（items里对应位置是None）；
+    否则必须是JSON数组，整体解析失败返回400。
+    """
+    if is_ndjson(content_type):
+        items, errors = [], {}
+        for line in body.splitlines():
+            if not line.strip():
+                continue
+            try:
+                items.append(json.loads(line))
+            except ValueError as e:
+                errors[len(items)] = [f'Invalid JSON: {e}']
+                items.append(None)
+        return items, errors
+    try:
+        items = json.loads(body)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f'Invalid JSON: {e}')
+    if not isinstance(items, list):
+        raise HTTPException(status_code=400, detail='Request body must be a JSON array or NDJSON')
+    return items, {}
+
+
+def validate_bulk_items(items: list, errors: Dict[int, List[str]]) -> Dict[int, dict]:
+    """整批一次校验，返回 下标 -> 校验后的dict；有错误的条目把原因记到errors里，其余的再校验一次"""
+    positions = [i for i in range(len(items)) if i not in errors]
+    try:
+        rows = BULK_ITEMS_ADAPTER.validate_python([items[i] for i in positions])
+    except ValidationError as e:
+        failed = set()
+        for error in e.errors():
+            index = positions[error['loc'][0]]
+            field = '.'.join(str(loc) for loc in error['loc'][1:])
+            errors.setdefault(index, []).append(f'{field}: {error["msg"]}' if field else error['msg'])
+            failed.add(index)
+        positions = [i for i in positions if i not in failed]
+        rows = BULK_ITEMS_ADAPTER.validate_python([items[i] for i in positions])
+    return dict(zip(positions, BULK_ITEMS_ADAPTER.dump_python(rows)))
+
+
+def ingest_data_points(db: Session, items: list, errors: Dict[int, List[str]]) -> schemas.ReadBulkResult:
+    rows = validate_bulk_items(items, errors)
+    city_ids = crud.get_city_ids(db)    # 一次查出所有城市的id，不逐条查
+    latest = {}     # (city_id, date) -> 下标，同一批里重复的以最后一条为准
+    for index, row in rows.items():
+        city_id = city_ids.get(row.pop('city'))
+        if city_id is None:
+            errors[index] = ['city: City not found']
+            continue
+        key = (city_id, row['date'])
+        if key in latest:
+            errors[latest[key]] = [f'Duplicate city and date, superseded by item {index}']
+        latest[key] = index
+
+    inserted = updated = 0
+    if latest:
+        keys = list(latest)
+        inserted, updated = crud.upsert_data_rows(db, [rows[latest[key]] for key in keys], [key[0] for key in keys])
+        if inserted or updated:
+            cities = {city_id for city_id, _ in keys}
+            crud.refresh_rollups(db, city_id=next(iter(cities)) if len(cities) == 1 else None,
+                                 since=min(day for _, day in keys))
+        db.commit()     # 整批一个事务，中途出错全部回滚
+        if inserted or updated:
+            data_changed()
+    return schemas.ReadBulkResult(
+        received=len(items), inserted=inserted, updated=updated, unchanged=len(latest) - inserted - updated,
+        failed=len(errors), errors=[schemas.BulkItemError(index=i, errors=errors[i]) for i in sorted(errors)],
+    )
+
+
+@application.post('/bulk_data', response_model=schemas.ReadBulkResult, openapi_extra={'requestBody': {
+    'required': True,
+    'content': {
+        'application/json': {'schema': {'type': 'array', 'items': schemas.CreateCityData.model_json_schema()}},
+        'application/x-ndjson': {'schema': {'type': 'string', 'description': '每行一个CreateCityData的JSON对象'}},
+    },
+}})
+async def create_data_bulk(request: Request, db: Session = Depends(get_db)):
+    """
+    批量写入数据，请求体是CreateCityData的JSON数组，或者Content-Type: application/x-ndjson时每行一条。
+    已有的(城市, 日期)会被更新。有问题的条目不影响其他条目，原因在返回值的errors里（index从0开始）。
+    """
+    content_type = request.headers.get('content-type', '')
+    body = await read_bulk_body(request, is_ndjson(content_type))
+    if not body.strip():
+        raise HTTPException(status_code=400, detail='Empty request body')
+    # 解析JSON、校验和写库都是CPU/阻塞操作，放到线程池里执行，不阻塞事件循环上的其他请求
+    return await run_in_threadpool(parse_and_ingest, db, body, content_type)
+
+
+def parse_and_ingest(db: Session, body: bytes, content_type: str) -> schemas.ReadBulkResult:
+    items, errors = parse_bulk_body(body, content_type)
+    if len(items) > settings.bulk_max_items:
+        raise HTTPException(status_code=413, detail=f'Too many items, at most {settings.bulk_max_items}')
+    return ingest_data_points(db, items, errors)
+
+
+'''-----------------------------------------------------'''
+
+
+
+
 '''--------------- 后台任务接口 ---------------'''
 
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
 from fastapi.background import BackgroundTasks
 from pydantic import HttpUrl
-import requests
+from covid19.jhu import JHU_URL, JHUClient
+from covid19.jobs import sync_jobs
+from typing import Callable, Optional
 from covid19.models import City, Data
 
-def bg_task(url:HttpUrl, db:Session):
-    """这里注意一个坑，不要在后台任务的参数中db: Session = Depends(get_db)这样导入依赖"""
-
-    city_data = requests.get(url=f"{url}?source=jhu&country_code=CN&timelines=false")
-    if city_data.status_code == 200:
-        # 将取得的数据更新到City表中
-        db.query(City).delete() # 同步数据前，先清空原有数据
-        for location in city_data.json()['locations']:
-            city = {
-                "province": location['province'],
-                "country": location['country'],
-                "country_code": "CN",
-                "country_population": location['country_population'],
-            }
-            crud.create_city(db=db, city=schemas.CreateCity(**city))
-        
-
-    
-    covid_data = requests.get(url=f"{url}?source=jhu&country_code=CN&timelines=true")
-    if covid_data.status_code == 200:
-        # 将取得的数据更新到Data表中
-        db.query(Data).delete() # 同步数据前，先清空原有数据
-        for city in covid_data.json()['locations']:
-            db_city = crud.get_city_by_name(db, city['province'])
-            for date, confirmed in city['timelines']['confirmed']['timeline'].items():
-                data = {
-                    "date": date.split('T')[0],     # 把'2020-12-31T00:00:00Z' 变成 ‘2020-12-31’
-                    "confirmed": confirmed,
-                    "deaths": city['timelines']['deaths']['timeline'][date],
-                    "recovered": 0   # 每个城市每天有多少人痊愈，这种数据没有
-                }
-                # 这个city_id是city表中的主键ID，不是coronavirus_data数据里的ID
-                crud.create_city_data(db=db, data=schemas.CreateData(**data), city_id=db_city.id)
+logger = logging.getLogger(__name__)
+
+
+def location_to_data(location:dict) -> List[dict]:
+    """把一个location的timelines转换成Data表的行"""
+    deaths = location['timelines']['deaths']['timeline']
+    return [{
+        "date": date.split('T')[0],     # 把'2020-12-31T00:00:00Z' 变成 ‘2020-12-31’
+        "confirmed": confirmed,
+        "deaths": deaths[date],
+        "recovered": 0   # 每个城市每天有多少人痊愈，这种数据没有
+    } for date, confirmed in location['timelines']['confirmed']['timeline'].items()]
+
+
+# 增量同步时每写入这么多行提交一次，限制单个事务的大小和写锁的持有时间；默认None，整个同步一个事务
+SYNC_COMMIT_ROWS = settings.sync_commit_rows
+
+
+def bg_task(url:HttpUrl, db:Session=None, incremental:bool=False, client:JHUClient=None, progress:Callable=None,
+            commit_rows:Optional[int]=SYNC_COMMIT_ROWS):
+    """
+    这里注意一个坑，不要在后台任务的参数中db: Session = Depends(get_db)这样导入依赖：
+    请求结束时get_db会关闭会话，而后台任务在请求结束后才运行。所以不传db时后台任务自己创建会话，结束时关闭。
+
+    incremental=False：先清空City和Data表再全量重建
+    incremental=True：按province和(city_id, date)增量同步，只写入新增和有变化的行
+    client：不传就用url新建一个JHUClient，同步结束后关闭
+    progress：进度回调progress(阶段, rows=, inserted=, updated=)，见jobs.SyncJob.report
+    commit_rows：增量同步时每写入这么多行提交一次；None表示整个同步只在最后提交一次。
+        只对增量同步生效：全量同步先清空表再重建，中途提交的话读请求会看到空表或只有一部分的表，所以总是一个事务。
+        分批提交时，失败前已提交的批次会保留，重新增量同步只会写入缺少的部分
+    """
+
+    # 批量多行INSERT，不再逐行commit + refresh；增量同步可以按commit_rows分批提交
+    start = time.perf_counter()
+    stats = {'rows': 0, 'inserted': 0, 'updated': 0}
+    report = progress or (lambda phase, **counts: None)
+    own_session = db is None
+    if own_session:
+        db = SessionLocal()
+    jhu = client or JHUClient(url)
+    pending = 0     # 上次提交之后写入的行数
+    try:
+        report('fetching')
+        # 两个请求并发：城市列表在另一个线程里取，同时这里开始接收体积大的timelines
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            cities_future = pool.submit(jhu.fetch_cities)
+            with jhu.stream_locations() as locations:
+                city_locations = cities_future.result()
+                if city_locations is not None:
+                    # 将取得的数据更新到City表中
+                    cities = [{
+                        "province": location['province'],
+                        "country": location['country'],
+                        "country_code": "CN",
+                        "country_population": location['country_population'],
+                    } for location in city_locations]
+                    if incremental:
+                        inserted, updated = crud.upsert_cities(db=db, cities=cities)
+                    else:
+                        db.query(City).delete() # 同步数据前，先清空原有数据
+                        inserted, updated = crud.bulk_create_cities(db=db, cities=cities), 0
+                    stats['rows'] += len(cities)
+                    stats['inserted'] += inserted
+                    stats['updated'] += updated
+                    report('cities', rows=len(cities), inserted=inserted, updated=updated)
+
+                if locations is not None:
+                    # 将取得的数据更新到Data表中：每解析完一个location就写入，内存占用和响应体大小无关
+                    city_ids = crud.get_city_ids(db)    # 一次查出所有城市的ID，代替逐个get_city_by_name
+                    if not incremental:
+                        db.query(Data).delete() # 同步数据前，先清空原有数据
+                    for location in locations:
+                        data = location_to_data(location)
+                        # 这个city_id是city表中的主键ID，不是coronavirus_data数据里的ID
+                        data_city_ids = [city_ids[location['province']]] * len(data)
+                        if incremental:
+                            inserted, updated = crud.upsert_city_data(db=db, data=data, city_ids=data_city_ids)
+                        else:
+                            inserted, updated = crud.bulk_create_city_data(db=db, data=data, city_ids=data_city_ids), 0
+                        stats['rows'] += len(data)
+                        stats['inserted'] += inserted
+                        stats['updated'] += updated
+                        report('data', rows=len(data), inserted=inserted, updated=updated)
+                        pending += inserted + updated
+                        if incremental and commit_rows and pending >= commit_rows:
+                            db.commit()
+                            pending = 0
+
+        report('rollups')
+        crud.refresh_rollups(db)    # 和数据在同一个事务里刷新汇总表
+        report('committing')
+        db.commit()
+    except Exception:
+        db.rollback()   # 回滚未提交的部分，不留下半开的事务
+        raise
+    finally:
+        if own_session:
+            db.close()
+        if client is None:
+            jhu.close()
+        data_changed()      # 同步结束（无论成功失败）后读接口的缓存全部失效，数据集版本号递增
+
+    stats['elapsed'] = time.perf_counter() - start
+    stats['rows_per_sec'] = stats['rows'] / stats['elapsed'] if stats['elapsed'] else 0.0
+    logger.info('JHU数据同步完成：%d 行（新增 %d，更新 %d），耗时 %.2f 秒，%.0f 行/秒',
+                stats['rows'], stats['inserted'], stats['updated'], stats['elapsed'], stats['rows_per_sec'])
+    return stats
 
 
 
 @application.get('/sync_coronavirus_data/jhu')
-def sync_coronavirus_data(background_tasks: BackgroundTasks, db: Session = Depends(get_db)):
+def sync_coronavirus_data(background_tasks: BackgroundTasks, incremental:bool=False):
     """
     从John Hopkins University获取最新的COVID-19感染数据，并同步到数据库。
+
+    incremental=true时只写入新增和有变化的数据，不再清空重建整张表。
+    同一时间只运行一个同步任务，已有任务在运行时不会再启动新任务，直接返回它的任务ID。
     """
-    background_tasks.add_task(bg_task, url="https://coronavirus-tracker-api.herokuapp.com/v2/locations", db=db)
-    
-    return {'message': '正在同步后台数据...'}
+    job, created = sync_jobs.start(incremental=incremental)
+    if created:
+        background_tasks.add_task(sync_jobs.run, job, bg_task, url=JHU_URL, incremental=incremental)    # 后台任务自己管理会话
+        return {'message': '正在同步后台数据...', 'job_id': job.id, 'coalesced': False}
+    return {'message': '已有同步任务在运行...', 'job_id': job.id, 'coalesced': True}
+
+
+# 同步任务的状态：阶段、已处理行数、耗时、吞吐量
+@application.get('/sync_coronavirus_data/jobs/current')
+def read_current_sync_job():
+    job = sync_jobs.current()
+    if job is None:
+        raise HTTPException(status_code=404, detail='No sync job')
+    return job.status()
+
+
+@application.get('/sync_coronavirus_data/jobs/{job_id}')
+def read_sync_job(job_id: str):
+    job = sync_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail='Job not found')
+    return job.status()
 
 
 '''-----------------------------------------------------'''
@@ -136,18 +590,54 @@ def sync_coronavirus_data(background_tasks: BackgroundTasks, db: Session = Depen
 
 from fastapi.templating import Jinja2Templates
 from fastapi.requests import Request
+from markupsafe import Markup
 
 templates = Jinja2Templates(directory='covid19/template')
+templates.env.globals['url_for'] = assets.url_for     # url_for('static', ...)解析成带哈希的文件名
+
+# 模板里{{ flush }}的位置把已经渲染好的部分发给浏览器；不流式渲染时模板里的flush是未定义的，输出空字符串
+FLUSH = Markup('<!-- flush -->')
+
+
+def stream_template(name:str, context:dict):
+    """逐段渲染模板，遇到FLUSH就把缓冲的内容作为一块发送，而不是每个模板片段都发一次"""
+    buffer = []
+    for piece in templates.get_template(name).generate(context):
+        if piece != FLUSH:
+            buffer.append(piece)
+        elif buffer:
+            yield ''.join(buffer)
+            buffer.clear()
+    if buffer:
+        yield ''.join(buffer)
+
 
 # 该接口前后端不分离，使用模板引擎。要么通过城市名称展示数据，要么就是个默认页面直接取前100条数据展示
 @application.get('/')
-def covid(request: Request, city:str = None, skip:int=0, limit:int=100, db: Session = Depends(get_db)):
-    data = crud.get_data(db, city=city, skip=skip, limit=limit)    # 该函数返回的是一个可迭代对象，可用for循环一条条展示
-    # 第一个参数是数据要返回的页面，第二个参数是要传递给模板的数据
-    return templates.TemplateResponse('home.html', {
-        'request': request, 
-        'data': data,
+def covid(request: Request, city:str = None, skip:int=Query(0, ge=0), limit:int=Query(100, ge=1),
+          stream:bool=False, flush_rows:int=Query(200, ge=1), db: Session = Depends(get_db)):
+    """
+    stream=true时流式渲染：页面框架（表头）立即发送，表格的行边查边发，每flush_rows行发送一次，
+    首字节时间和limit无关。页面底部有上一页/下一页（skip/limit）。
+    """
+    dataset_version.refresh()
+    if dataset_version.not_modified(request):   # 数据没变过，不查库也不渲染模板
+        return Response(status_code=304, headers=dataset_version.headers())
+    context = {
+        'request': request,
+        'skip': skip,
+        'limit': limit,
         'sync_data_url':'sync_coronavirus_data/jhu'
-        })
+    }
+    if stream:
+        # 会话由get_db在响应发送完以后才关闭，所以生成器里可以继续从游标取数据
+        context.update(data=crud.stream_data_page(db, city=city, skip=skip, limit=limit, batch_size=flush_rows),
+                       flush=FLUSH, flush_rows=flush_rows)
+        return StreamingResponse(stream_template('home.html', context), media_type='text/html',
+                                 headers=dataset_version.headers())
+    # 该函数返回的是一个可迭代对象，可用for循环一条条展示；页面要显示d.city.province，所以用JOIN一次性把城市查出来
+    context['data'] = db.scalars(crud.select_data_page(city=city, skip=skip, limit=limit)).all()
+    # 第一个参数是数据要返回的页面，第二个参数是要传递给模板的数据
+    return templates.TemplateResponse(request, 'home.html', context, headers=dataset_version.headers())
 
 '''----------------------------------------------------------'''
\ No newline at end of file
@@ -0,0 +1,222 @@
+"""
+请求指标：每个路由的延迟直方图、进行中的请求数、状态码计数、响应字节数，以Prometheus文本格式在/metrics输出
+
+标签里的route是路由模板（例如/covid19/city/{city}），不是原始路径，否则每个城市名都会变成一组新的时间序列。
+没有匹配到任何路由的请求（404）统一记为route="unmatched"。
+p50/p99在Prometheus里用histogram_quantile(0.99, sum by (le, route) (rate(http_request_duration_seconds_bucket[5m])))计算。
+指标保存在进程内存里，多个worker进程时每个进程各自一份，由Prometheus分别抓取后汇总。
+"""
+
+import threading
+import time
+from bisect import bisect_left
+from collections import OrderedDict
+from typing import Sequence, Tuple
+
+from starlette.responses import Response
+from starlette.routing import Match
+
+# 延迟直方图的桶（秒），和prometheus_client的默认值一样
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 7.5, 10.0)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+UNMATCHED = 'unmatched'
+
+
+def _format_labels(names:Sequence[str], values:Sequence[str], extra:str='') -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, (
+        str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for v in values))]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value:float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Metric:
+    """一个指标的所有时间序列，按标签值的元组区分；同步接口跑在线程池里，需要加锁"""
+    type = ''
+
+    def __init__(self, name:str, documentation:str, labels:Sequence[str]=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def header(self) -> list:
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type}']
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, labels:Tuple[str, ...]=(), amount:float=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def get(self, labels:Tuple[str, ...]=()) -> float:
+        return self._values.get(labels, 0)
+
+    def render(self) -> list:
+        with self._lock:
+            items = sorted(self._values.items())
+        return self.header() + [f'{self.name}{_format_labels(self.labels, k)} {_format_value(v)}' for k, v in items]
+
+
+class Gauge(Counter):
+    type = 'gauge'
+
+    def dec(self, labels:Tuple[str, ...]=(), amount:float=1):
+        self.inc(labels, -amount)
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name:str, documentation:str, labels:Sequence[str]=(), buckets:Sequence[float]=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, labels:Tuple[str, ...], value:float):
+        index = bisect_left(self.buckets, value)    # 落在第一个 >= value 的桶里，超过最大的桶只计入+Inf
+        with self._lock:
+            counts, total = self._values.get(labels, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[index] += 1
+            self._values[labels] = (counts, total + value)
+
+    def count(self, labels:Tuple[str, ...]) -> int:
+        counts, _ = self._values.get(labels, ((), 0))
+        return sum(counts)
+
+    def render(self) -> list:
+        with self._lock:
+            items = sorted((k, (list(counts), total)) for k, (counts, total) in self._values.items())
+        lines = self.header()
+        for labels, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float('inf')), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else _format_value(bound)
+                bucket_labels = _format_labels(self.labels, labels, 'le="%s"' % le)
+                lines.append(f'{self.name}_bucket{bucket_labels} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labels, labels)} {_format_value(total)}')
+            lines.append(f'{self.name}_count{_format_labels(self.labels, labels)} {cumulative}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric:Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> bytes:
+        return ('\n'.join(line for metric in self.metrics for line in metric.render()) + '\n').encode()
+
+
+class HTTPMetrics:
+    """一个应用的HTTP请求指标"""
+
+    def __init__(self, registry:Registry=None):
+        self.registry = registry or Registry()
+        self.duration = self.registry.register(Histogram(
+            'http_request_duration_seconds', '请求处理时间（到响应体发送完），按路由模板', ('method', 'route')))
+        self.in_progress = self.registry.register(Gauge(
+            'http_requests_in_progress', '正在处理的请求数', ('method', 'route')))
+        self.requests = self.registry.register(Counter(
+            'http_requests_total', '请求数，按状态码', ('method', 'route', 'status')))
+        self.response_size = self.registry.register(Counter(
+            'http_response_size_bytes_total', '响应体字节数（压缩后）', ('method', 'route')))
+
+
+http_metrics = HTTPMetrics()
+
+
+class RouteTemplates:
+    """
+    请求 -> 路由模板（指标的route标签）。在调用应用之前按routes匹配一次（进行中的请求数需要），
+    结果按(方法, 路径)缓存，缓存满了淘汰最久未用的。MetricsMiddleware和profiler.QueryProfilerMiddleware共用，两边的标签一致。
+    """
+
+    def __init__(self, routes=None, cache_size:int=4096):
+        self.routes = routes        # 通常是FastAPI应用的app.routes（list，之后注册的路由也能看到）
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __call__(self, scope) -> str:
+        key = (scope['method'], scope['path'])
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+        template = UNMATCHED
+        partial = None
+        for route in self.routes or ():
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                template = route.path
+                break
+            if match == Match.PARTIAL and partial is None:     # 路径对但方法不对（405）
+                partial = route.path
+        else:
+            template = partial or UNMATCHED
+        with self._lock:
+            self._cache[key] = template
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return template
+
+
+class MetricsMiddleware:
+    """纯ASGI中间件，按路由模板（RouteTemplates）记录请求指标"""
+
+    def __init__(self, app, routes=None, metrics:HTTPMetrics=None, cache_size:int=4096):
+        self.app = app
+        self.route_template = RouteTemplates(routes, cache_size)
+        self.metrics = metrics or http_metrics
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        method = scope['method']
+        labels = (method, self.route_template(scope))
+        status = 500    # 应用抛出异常、没有发送响应头时按500计
+        size = 0
+        finished = False
+        start = time.perf_counter()
+
+        def finish():
+            nonlocal finished
+            if finished:
+                return
+            finished = True
+            self.metrics.duration.observe(labels, time.perf_counter() - start)
+            self.metrics.requests.inc((*labels, str(status)))
+            self.metrics.response_size.inc(labels, size)
+            self.metrics.in_progress.dec(labels)
+
+        async def metrics_send(message):
+            nonlocal status, size
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            elif message['type'] == 'http.response.body':
+                size += len(message.get('body', b''))
+            await send(message)
+            if message['type'] == 'http.response.body' and not message.get('more_body', False):
+                finish()    # 响应发送完就记录，不算之后运行的后台任务
+
+        self.metrics.in_progress.inc(labels)
+        try:
+            await self.app(scope, receive, metrics_send)
+        finally:
+            finish()
+
+
+async def metrics_endpoint(request):
+    return Response(http_metrics.registry.render(), media_type=CONTENT_TYPE)
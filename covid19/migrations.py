@@ -0,0 +1,90 @@
+"""
+已有数据库的原地升级
+
+Base.metadata.create_all只会创建不存在的表，不会给已经存在的表补索引，
+所以老的covid19.sqlite3要靠这里把models.py里声明的索引补上，并删掉多余的索引。
+建唯一索引之前先删掉重复的行（例如并发同步写进去的同一城市同一天的多条数据），每组只保留最后写入的一条。
+新加的汇总表由create_all创建，但里面是空的，这里用已有数据回填一次。
+数据集版本号（dataset_version表，只有一行）也在这里插入，读接口只读不写。
+
+运行方式（在项目根目录）：python -m covid19.migrations
+"""
+
+import logging
+import time
+
+from sqlalchemy import Table, and_, func, inspect, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from covid19 import crud, models
+from covid19.database import Base
+
+
+logger = logging.getLogger(__name__)
+
+# 旧版本models.py在主键上又加了index=True，主键本身就有索引，这两个是多余的
+REDUNDANT_INDEXES = {
+    'city': ['ix_city_id'],
+    'data': ['ix_data_id'],
+}
+
+
+def delete_duplicates(conn, table:Table, columns) -> int:
+    """唯一索引的列上有重复值时，每组只保留id最大的一行，返回删除的行数；列是NULL的行不算重复"""
+    keep = select(func.max(table.c.id)).where(and_(*(column.isnot(None) for column in columns))).group_by(*columns)
+    stmt = table.delete().where(and_(*(column.isnot(None) for column in columns)), table.c.id.not_in(keep))
+    return conn.execute(stmt).rowcount
+
+
+def upgrade_schema(engine:Engine):
+    """补齐models.py里声明但数据库里还没有的索引，删除多余的索引。可以重复执行"""
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {index['name'] for index in inspector.get_indexes(table.name)}
+            for name in REDUNDANT_INDEXES.get(table.name, []):
+                if name in existing:
+                    conn.exec_driver_sql(f'DROP INDEX {name}')
+                    logger.info('删除多余的索引 %s', name)
+            for index in table.indexes:
+                if index.name not in existing:
+                    if index.unique:
+                        deleted = delete_duplicates(conn, table, list(index.columns))
+                        if deleted:
+                            logger.warning('创建唯一索引 %s 之前删除了 %d 条重复数据', index.name, deleted)
+                    index.create(bind=conn)
+                    logger.info('创建索引 %s', index.name)
+        seed_dataset_version(conn)
+    backfill_rollups(engine)
+
+
+def seed_dataset_version(conn):
+    """插入数据集版本号那一行（见cache.DatasetVersion），已经有了就不动；多个进程同时升级时只有一个插入成功"""
+    table = models.DatasetState.__table__
+    table.create(bind=conn, checkfirst=True)    # 老数据库没执行过create_all时也要有这张表
+    conn.execute(sqlite_insert(table).values(id=1, generation=0, modified=int(time.time())).on_conflict_do_nothing())
+
+
+def backfill_rollups(engine:Engine):
+    """有数据但汇总表还是空的（汇总表是后加的），用已有数据算一次"""
+    inspector = inspect(engine)
+    if not all(inspector.has_table(model.__tablename__) for model in (models.Data, models.CitySummary, models.NationalDaily)):
+        return  # 还没执行create_all
+    with Session(engine) as db:
+        has_data = db.scalar(select(models.Data.id).limit(1)) is not None
+        has_rollups = db.scalar(select(models.NationalDaily.date).limit(1)) is not None
+        if has_data and not has_rollups:
+            crud.refresh_rollups(db)
+            db.commit()
+            logger.info('回填汇总表')
+
+
+if __name__ == '__main__':
+    from covid19.database import engine
+
+    logging.basicConfig(level=logging.INFO)
+    upgrade_schema(engine)
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, Integer, BigInteger, Date, DateTime, ForeignKey, func
+from sqlalchemy import Column, String, Integer, BigInteger, Date, DateTime, ForeignKey, Index, func
 from sqlalchemy.orm import relationship
 '''
 relationship 是 SQLAlchemy ORM 中的核心功能，用于定义表之间的 逻辑关联关系 。它与外键配合使用，实现了对象之间的导航和操作。
@@ -11,7 +11,7 @@ from .database import Base
 class City(Base):
     __tablename__ = 'city'  # 数据表的表名
 
-    id = Column(Integer, primary_key=True, index=True, autoincrement=True)
+    id = Column(Integer, primary_key=True, autoincrement=True)  # 主键本身就有索引，不需要再加index=True
     province = Column(String(100), unique=True, nullable=False, comment='省/直辖市')
     country = Column(String(100), nullable=False, comment='国家')
     country_code = Column(String(100), nullable=False, comment='国家代码')
@@ -28,8 +28,14 @@ class City(Base):
 
 class Data(Base):
     __tablename__ = 'data'
-
-    id = Column(Integer, primary_key=True, index=True, autoincrement=True)
+    __table_args__ = (
+        # 按城市查询、按城市取时间线、增量同步按(city_id, date)定位，都走这个索引；同一城市同一天只有一条数据
+        Index('ix_data_city_id_date', 'city_id', 'date', unique=True),
+        # 按日期跨城市查询（全国汇总、按日期过滤导出）
+        Index('ix_data_date', 'date'),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
     city_id = Column(Integer, ForeignKey('city.id'), comment='所属省/直辖市')  # ForeignKey里的字符串格式不是类名.属性名，而是表名.字段名
     date = Column(Date, nullable=False, comment='数据日期')
     confirmed = Column(BigInteger, default=0, nullable=False, comment='确诊数量')
@@ -45,6 +51,50 @@ class Data(Base):
 
 
 
+class CitySummary(Base):
+    """汇总表：每个省/直辖市最新一天的累计数和当天新增数，每次同步后由crud.refresh_rollups重新计算"""
+    __tablename__ = 'city_summary'
+
+    city_id = Column(Integer, ForeignKey('city.id'), primary_key=True, comment='所属省/直辖市')
+    province = Column(String(100), unique=True, nullable=False, comment='省/直辖市')
+    date = Column(Date, nullable=False, comment='最新数据日期')
+    confirmed = Column(BigInteger, default=0, nullable=False, comment='累计确诊数量')
+    deaths = Column(BigInteger, default=0, nullable=False, comment='累计死亡数量')
+    recovered = Column(BigInteger, default=0, nullable=False, comment='累计痊愈数量')
+    new_confirmed = Column(BigInteger, default=0, nullable=False, comment='当天新增确诊数量')
+    new_deaths = Column(BigInteger, default=0, nullable=False, comment='当天新增死亡数量')
+
+    def __repr__(self):
+        return f'{self.province}_{repr(self.date)}：累计确诊{self.confirmed}例'
+
+
+
+class NationalDaily(Base):
+    """汇总表：全国每天的累计数和新增数，每次同步后由crud.refresh_rollups重新计算"""
+    __tablename__ = 'national_daily'
+
+    date = Column(Date, primary_key=True, comment='数据日期')
+    confirmed = Column(BigInteger, default=0, nullable=False, comment='累计确诊数量')
+    deaths = Column(BigInteger, default=0, nullable=False, comment='累计死亡数量')
+    recovered = Column(BigInteger, default=0, nullable=False, comment='累计痊愈数量')
+    new_confirmed = Column(BigInteger, default=0, nullable=False, comment='当天新增确诊数量')
+    new_deaths = Column(BigInteger, default=0, nullable=False, comment='当天新增死亡数量')
+
+    def __repr__(self):
+        return f'全国_{repr(self.date)}：累计确诊{self.confirmed}例'
+
+
+
+class DatasetState(Base):
+    """只有一行：数据集版本号，每次写入后由cache.DatasetVersion.bump加1，所有worker进程据此生成ETag、让响应缓存失效"""
+    __tablename__ = 'dataset_version'
+
+    id = Column(Integer, primary_key=True)
+    generation = Column(Integer, default=0, nullable=False, comment='写入次数')
+    modified = Column(Integer, nullable=False, comment='最后写入时间（Unix秒），即Last-Modified')
+
+
+
 """ 附上三个SQLAlchemy教程
 
 SQLAlchemy的基本操作大全 
@@ -0,0 +1,156 @@
+"""
+SQL查询分析：每个请求执行了多少条SQL、花了多少时间，慢查询日志（带EXPLAIN QUERY PLAN），N+1查询检测
+
+代替echo=True的逐条打印：在所有Engine上挂before/after_cursor_execute事件（同步、异步、读写引擎都包括），
+查询计入当前请求的RequestProfile（用contextvars传递，线程池里的同步接口和异步会话的greenlet里都能拿到）。
+- 响应头X-DB-Query-Count、X-DB-Query-Time（毫秒），/metrics里按路由模板累计查询数和耗时
+- 超过slow_query_ms的查询记一条WARNING日志，SQLite下附上EXPLAIN QUERY PLAN（看是否走了索引）
+- 同一个请求里同一条SQL（参数可以不同）执行了n_plus_one_threshold次以上，记WARNING日志并计数，
+  典型情况是循环里访问d.city这种懒加载关系
+"""
+
+import logging
+import time
+from collections import Counter
+from contextvars import ContextVar
+from typing import Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from covid19.metrics import Counter as MetricCounter, Histogram, RouteTemplates, http_metrics
+from covid19.settings import settings
+
+logger = logging.getLogger(__name__)
+
+QUERY_COUNT_HEADER = 'X-DB-Query-Count'
+QUERY_TIME_HEADER = 'X-DB-Query-Time'
+QUERY_COUNT_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100, 200)
+
+
+class RequestProfile:
+    """一个请求里执行的SQL"""
+
+    def __init__(self):
+        self.count = 0
+        self.total_time = 0.0
+        self.statements = Counter()     # SQL语句 -> 执行次数
+        self.closed = False             # 响应发送完以后关闭，之后的查询（例如后台任务里的）不再计入这个请求
+
+    def record(self, statement:str, elapsed:float):
+        if self.closed:
+            return
+        self.count += 1
+        self.total_time += elapsed
+        self.statements[statement] += 1
+
+    def repeated(self, threshold:int) -> list:
+        """执行次数达到threshold的语句，[(语句, 次数)]，次数多的在前"""
+        return [(statement, n) for statement, n in self.statements.most_common() if n >= threshold]
+
+
+_current_profile: ContextVar[Optional[RequestProfile]] = ContextVar('current_profile', default=None)
+
+
+def explain(conn, statement:str, parameters) -> list:
+    """用同一个连接执行EXPLAIN QUERY PLAN；直接用DBAPI游标，不再触发cursor_execute事件"""
+    cursor = conn.connection.cursor()
+    try:
+        cursor.execute(f'EXPLAIN QUERY PLAN {statement}', parameters)
+        return [row[-1] for row in cursor.fetchall()]
+    finally:
+        cursor.close()
+
+
+# 开始时间放在这次执行的context上，语句出错（没有after_cursor_execute）时随context一起丢弃，
+# 不会像放在conn.info（属于连接池里的连接）上那样越积越多
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._query_start = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = getattr(context, '_query_start', None)
+    if start is None:
+        return
+    elapsed = time.perf_counter() - start
+    profile = _current_profile.get()
+    if profile is not None:
+        profile.record(statement, elapsed)
+    if elapsed * 1000 < settings.slow_query_ms:
+        return
+    plan = []
+    # executemany（批量插入）没法EXPLAIN；只有SQLite支持EXPLAIN QUERY PLAN这种写法
+    verb = statement.split(None, 1)[0].upper() if statement.strip() else ''
+    if not executemany and conn.dialect.name == 'sqlite' and verb in ('SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE'):
+        try:
+            plan = explain(conn, statement, parameters)
+        except Exception as e:      # EXPLAIN失败不能影响原来的查询
+            plan = [f'EXPLAIN failed: {e}']
+    logger.warning('Slow query (%.1f ms): %s\nparameters: %r\nplan:\n  %s',
+                   elapsed * 1000, statement, parameters, '\n  '.join(plan) or '-')
+
+
+class DBMetrics:
+    def __init__(self, registry=None):
+        registry = registry or http_metrics.registry
+        self.queries = registry.register(Histogram(
+            'db_queries_per_request', '每个请求执行的SQL条数', ('method', 'route'), buckets=QUERY_COUNT_BUCKETS))
+        self.query_time = registry.register(MetricCounter(
+            'db_query_seconds_total', 'SQL执行时间合计（秒）', ('method', 'route')))
+        self.repeated = registry.register(MetricCounter(
+            'db_repeated_statements_total', '疑似N+1：同一请求里重复执行超过阈值的语句数', ('method', 'route')))
+
+
+db_metrics = DBMetrics()
+
+
+class QueryProfilerMiddleware:
+    """纯ASGI中间件：给每个请求建一个RequestProfile，响应头里带上查询数和耗时，请求结束后记指标、检查N+1"""
+
+    def __init__(self, app, routes=None, metrics:DBMetrics=None, n_plus_one_threshold:int=None):
+        self.app = app
+        self.route_template = RouteTemplates(routes)     # 和MetricsMiddleware一样的route标签
+        self.metrics = metrics or db_metrics
+        self.n_plus_one_threshold = n_plus_one_threshold or settings.n_plus_one_threshold
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        labels = (scope['method'], self.route_template(scope))
+        profile = RequestProfile()
+        token = _current_profile.set(profile)
+
+        def close():
+            if not profile.closed:
+                profile.closed = True
+                self.finish(scope, labels, profile)
+
+        async def profiler_send(message):
+            if message['type'] == 'http.response.start':
+                # 响应头发出时的统计；流式响应之后的查询只计入指标和日志
+                message['headers'] = [*message.get('headers', []),
+                                      (QUERY_COUNT_HEADER.lower().encode(), str(profile.count).encode()),
+                                      (QUERY_TIME_HEADER.lower().encode(), f'{profile.total_time * 1000:.3f}'.encode())]
+            await send(message)
+            if message['type'] == 'http.response.body' and not message.get('more_body', False):
+                # 和MetricsMiddleware一样，响应发送完就结束统计，不算之后运行的后台任务（例如同步数据）。
+                # 后台任务可能运行在复制出来的context里（BaseHTTPMiddleware），reset这里的contextvar管不到，所以关闭profile
+                close()
+
+        try:
+            await self.app(scope, receive, profiler_send)
+        finally:
+            _current_profile.reset(token)
+            close()
+
+    def finish(self, scope, labels:tuple, profile:RequestProfile):
+        if profile.count:
+            self.metrics.queries.observe(labels, profile.count)
+            self.metrics.query_time.inc(labels, profile.total_time)
+        for statement, n in profile.repeated(self.n_plus_one_threshold):
+            self.metrics.repeated.inc(labels)
+            logger.warning('Possible N+1 query in %s %s: executed %d times\n%s', scope['method'], scope['path'], n, statement)
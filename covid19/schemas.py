@@ -1,5 +1,6 @@
 
 from pydantic import BaseModel
+from typing import List, Optional
 from datetime import datetime
 from datetime import date as date_
 
@@ -27,6 +28,13 @@ class City(Base):
 
 class CreateCity(BaseModel):
     """字段参考models.py里的City类"""
+    province: str
+    country: str
+    country_code: str
+    country_population: int = 0
+
+
+class ReadCity(CreateCity):
     id: int
     created_at:datetime
     updated_at:datetime
@@ -36,13 +44,6 @@ class CreateCity(BaseModel):
     }
 
 
-class ReadCity(CreateCity):
-    province: str
-    country: str
-    country_code: str
-    country_population: int = 0
-
-
 '''
 class Data(Base):
     __tablename__ = 'data'
@@ -68,6 +69,14 @@ class Data(Base):
 
 class CreateData(BaseModel):
     """字段参考models.py里的Data类"""
+    date: date_
+    confirmed: int = 0
+    deaths: int = 0
+    recovered: int = 0
+
+
+
+class ReadData(CreateData):
     id: int
     city_id:int
     created_at:datetime
@@ -79,10 +88,68 @@ class CreateData(BaseModel):
 
 
 
-class ReadData(CreateData):
+class ReadNationalDaily(BaseModel):
+    """字段参考models.py里的NationalDaily类"""
     date: date_
     confirmed: int = 0
     deaths: int = 0
     recovered: int = 0
+    new_confirmed: int = 0
+    new_deaths: int = 0
+
+    model_config = {
+        "from_attributes": True,
+    }
+
+
+class ReadCitySummary(ReadNationalDaily):
+    """字段参考models.py里的CitySummary类"""
+    city_id: int
+    province: str
+
+
+
+class ReadCityAnalytics(BaseModel):
+    """analytics.py计算出的时间序列指标，各列表和dates一一对应，数据不足的位置为null"""
+    province: str
+    dates: List[date_]
+    confirmed: List[int]
+    deaths: List[int]
+    new_cases: List[int]
+    new_cases_ma: List[Optional[float]]     # N日移动平均
+    growth_rate: List[Optional[float]]      # 累计确诊日增长率
+    doubling_time: List[Optional[float]]    # 按最近N天增长推算的翻倍天数
+
+
+
+class ReadDataPoint(BaseModel):
+    """范围查询返回的数据点，只有数量，不含id和时间戳"""
+    date: date_
+    confirmed: int = 0
+    deaths: int = 0
+    recovered: int = 0
+
+    model_config = {
+        "from_attributes": True,
+    }
+
+
+
+class CreateCityData(CreateData):
+    """批量写入接口的一条数据，city是省/直辖市名称（对应City.province）"""
+    city: str
+
+
+class BulkItemError(BaseModel):
+    """批量写入时第index条（从0开始）没有写入的原因"""
+    index: int
+    errors: List[str]
+
 
-    
+class ReadBulkResult(BaseModel):
+    received: int       # 收到的条数
+    inserted: int       # 新增的行数
+    updated: int        # 数量有变化、已更新的行数
+    unchanged: int      # 和数据库里一样，没有改动的行数
+    failed: int         # 没有写入的条数，原因见errors
+    errors: List[BulkItemError]
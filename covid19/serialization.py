@@ -0,0 +1,77 @@
+"""
+响应体的快速JSON序列化
+
+FastAPI默认对response_model做三步：校验成Pydantic对象 -> 序列化成dict/list -> 标准库json.dumps，
+后两步都在Python里逐个字段处理。这里用预先编译好的TypeAdapter，校验（from_attributes，直接读ORM对象的属性）
+之后在pydantic-core里直接输出JSON字节，中间不生成dict，也不经过json模块。
+
+FastJSONRoute是APIRoute的子类，作为APIRouter(route_class=...)使用（settings.fast_json开启），
+路由声明的response_model不变，所以OpenAPI文档和原来一样；不支持response_model_include/exclude等选项。
+注入的Response参数上设置的状态码、响应头和cookie和FastAPI默认的处理一样合并到响应里。
+"""
+
+import functools
+import inspect
+from typing import Any
+
+from fastapi import Response
+from fastapi.routing import APIRoute
+from fastapi.utils import is_body_allowed_for_status_code
+from pydantic import TypeAdapter
+
+
+SUB_RESPONSE_PARAM = '_fast_json_response'     # FastJSONRoute给接口加的Response参数名
+
+
+@functools.lru_cache(maxsize=None)
+def json_adapter(response_model) -> TypeAdapter:
+    """每个响应模型只建一次TypeAdapter（建TypeAdapter要编译校验器和序列化器，比序列化一次慢得多）"""
+    return TypeAdapter(response_model)
+
+
+def dump_json(response_model, content:Any) -> bytes:
+    """ORM对象（或它们的列表）按response_model校验并序列化成JSON字节"""
+    adapter = json_adapter(response_model)
+    return adapter.dump_json(adapter.validate_python(content, from_attributes=True))
+
+
+class FastJSONRoute(APIRoute):
+    """接口返回的不是Response时，用dump_json生成响应，不走FastAPI默认的序列化"""
+
+    def __init__(self, path:str, endpoint, **kwargs):
+        # 包一层endpoint；functools.wraps保留原函数的签名，依赖注入和返回值注解推断response_model都不受影响。
+        # 返回值是Response时FastAPI不再合并注入的Response参数（接口和依赖在上面设置的状态码、响应头、cookie），
+        # 所以这里也要拿到它，自己合并。接口本身没有声明Response参数时，给签名加一个只由这里使用的参数
+        signature = inspect.signature(endpoint)
+        declared = next((p.name for p in signature.parameters.values()
+                         if inspect.isclass(p.annotation) and issubclass(p.annotation, Response)), None)
+        name = declared or SUB_RESPONSE_PARAM
+
+        def call_kwargs(kw:dict):
+            return kw[name] if declared else kw.pop(name), kw
+
+        if inspect.iscoroutinefunction(endpoint):
+            @functools.wraps(endpoint)
+            async def fast_endpoint(*args, **kw):
+                sub_response, kw = call_kwargs(kw)
+                return self.render(await endpoint(*args, **kw), sub_response)
+        else:
+            @functools.wraps(endpoint)
+            def fast_endpoint(*args, **kw):
+                sub_response, kw = call_kwargs(kw)
+                return self.render(endpoint(*args, **kw), sub_response)
+        if not declared:
+            fast_endpoint.__signature__ = signature.replace(parameters=[
+                *signature.parameters.values(),
+                inspect.Parameter(SUB_RESPONSE_PARAM, inspect.Parameter.KEYWORD_ONLY, annotation=Response)])
+        super().__init__(path, fast_endpoint, **kwargs)
+
+    def render(self, content:Any, sub_response:Response):
+        if self.response_model is None or isinstance(content, Response):
+            return content
+        # 和FastAPI默认的处理一样：注入的Response上设置的状态码优先，它的响应头（包括Set-Cookie）追加到响应里
+        status_code = sub_response.status_code or self.status_code or 200
+        body = dump_json(self.response_model, content) if is_body_allowed_for_status_code(status_code) else b''
+        response = Response(body, status_code=status_code, media_type='application/json')
+        response.headers.raw.extend(sub_response.headers.raw)
+        return response
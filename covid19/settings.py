@@ -0,0 +1,107 @@
+"""
+covid19项目的配置，全部可以通过环境变量设置
+
+COVID19_ENV选择一套预设（profile），再用单独的环境变量覆盖其中某一项，例如：
+    COVID19_ENV=production COVID19_POOL_SIZE=40 uvicorn run:app
+
+development：和最初的database.py一致，记录所有SQL语句（echo），不设置SQLite的PRAGMA
+production：不记录SQL语句，连接池更大，连接时设置WAL等PRAGMA（WAL模式下读连接不会被正在写入的同步阻塞）
+"""
+
+import os
+from typing import List, Optional, get_args
+
+from pydantic import BaseModel
+
+
+class Settings(BaseModel):
+    env: str = 'development'
+    database_url: str = 'sqlite:///./covid19.sqlite3'
+    # 读库，多个用逗号分隔（例如同步过来的副本文件），GET请求轮流使用；不设置时用只读连接打开database_url
+    read_database_urls: Optional[str] = None
+
+    # 引擎
+    echo: bool = True                   # 记录所有语句及其参数，开发时方便调试，生产环境的热路径上开销很大
+    pool_size: int = 5                  # 连接池常驻的连接数
+    max_overflow: int = 10              # 连接池满了以后最多再临时建立多少个连接
+    pool_timeout: float = 30.0          # 等待空闲连接的最长时间（秒）
+
+    # SQLite的PRAGMA，None表示不设置（使用SQLite的默认值），每个新连接建立时执行
+    sqlite_journal_mode: Optional[str] = None   # WAL：读写互不阻塞
+    sqlite_synchronous: Optional[str] = None    # WAL模式下NORMAL已经足够安全，比FULL少很多次fsync
+    sqlite_cache_size: Optional[int] = None     # 负数表示KiB，-65536即64MiB页缓存
+    sqlite_mmap_size: Optional[int] = None      # 用内存映射读数据库文件（字节）
+    sqlite_temp_store: Optional[str] = None     # MEMORY：排序、临时表放在内存里
+
+    # 其他
+    sync_commit_rows: Optional[int] = None      # 增量同步时每写入多少行提交一次，None为整个同步一个事务，见main.bg_task
+    sync_job_timeout: float = 1800.0            # 同步任务超过这么多秒没有进度就视为失败，可以启动新的同步，见jobs.py
+    columnar_snapshot: bool = False             # 是否启用内存列式快照，见columnar.py
+    cache_maxsize: int = 256                    # 响应缓存的条目数上限，见cache.py
+    cache_ttl: float = 300.0                    # 响应缓存的过期时间（秒）
+    dataset_version_poll: float = 1.0           # 每隔多少秒读一次数据库里的数据集版本号，其他worker的写入最多这么久后生效；0表示每个请求都读
+    slow_query_ms: float = 100.0                # 超过这个毫秒数的SQL记慢查询日志，见profiler.py
+    n_plus_one_threshold: int = 5               # 同一请求里同一条SQL执行这么多次以上，记为疑似N+1
+    bulk_max_items: int = 100000                # 批量写入接口一个请求最多的条数
+    bulk_max_bytes: int = 33554432              # 批量写入接口请求体最大的字节数（32MiB），超过的边读边拒绝
+    fast_json: bool = False                     # covid19路由用serialization.FastJSONRoute序列化响应体
+
+    # 响应压缩，见compression.py
+    compression_minimum_size: int = 1024        # 小于这个字节数的响应不压缩
+    compression_gzip_level: int = 6             # 1~9
+    compression_brotli_quality: int = 4         # 0~11，动态响应不要用太高的级别
+    compression_offload_size: int = 262144      # 大于这个字节数的响应体在线程池里压缩
+
+    @property
+    def sqlite_pragmas(self) -> dict:
+        pragmas = {
+            'journal_mode': self.sqlite_journal_mode,
+            'synchronous': self.sqlite_synchronous,
+            'cache_size': self.sqlite_cache_size,
+            'mmap_size': self.sqlite_mmap_size,
+            'temp_store': self.sqlite_temp_store,
+        }
+        return {name: value for name, value in pragmas.items() if value is not None}
+
+    @property
+    def read_urls(self) -> List[str]:
+        if not self.read_database_urls:
+            return [self.database_url]
+        return [url.strip() for url in self.read_database_urls.split(',') if url.strip()]
+
+
+PROFILES = {
+    'development': {},
+    'production': {
+        'echo': False,
+        'pool_size': 20,
+        'max_overflow': 20,
+        'sqlite_journal_mode': 'WAL',
+        'sqlite_synchronous': 'NORMAL',
+        'sqlite_cache_size': -65536,
+        'sqlite_mmap_size': 268435456,
+        'sqlite_temp_store': 'MEMORY',
+        'fast_json': True,
+    },
+}
+
+
+def load_settings(environ=os.environ) -> Settings:
+    """先取COVID19_ENV对应的预设，再用COVID19_<字段名大写>环境变量覆盖，由pydantic做类型转换"""
+    env = environ.get('COVID19_ENV', 'development')
+    if env not in PROFILES:
+        raise ValueError(f'Unknown COVID19_ENV: {env}, expected one of {list(PROFILES)}')
+    values = {'env': env, **PROFILES[env]}
+    for name, field in Settings.model_fields.items():
+        key = f'COVID19_{name.upper()}'
+        if key in environ:
+            value = environ[key]
+            if value == '':
+                if type(None) not in get_args(field.annotation):
+                    continue            # 不能是None的字段（例如COVID19_POOL_SIZE=）设为空字符串时保持预设值
+                value = None            # Optional字段设为空字符串表示None，例如关闭某个PRAGMA
+            values[name] = value
+    return Settings(**values)
+
+
+settings = load_settings()
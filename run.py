@@ -40,9 +40,10 @@ app.include_router(app08, prefix='/chapter08', tags=['第八章 中间件、CORS
 
 ''' ************** Chapter04 5. FastAPI项目的静态文件配置 ************** '''
 
-from fastapi.staticfiles import StaticFiles
+from covid19.assets import PrecompressedStaticFiles
 # path是Http请求的路径，app是StaticFiles类的实例，directory是静态文件所在的目录，name是挂载的名称
-app.mount(path='/static', app=StaticFiles(directory='covid19/static'), name='static')
+# PrecompressedStaticFiles是StaticFiles的子类：python -m covid19.assets构建过以后，发送带哈希的预压缩文件并长期缓存
+app.mount(path='/static', app=PrecompressedStaticFiles(directory='covid19/static'), name='static')
 # mount表示将某个目录下一个完全独立的应用挂载过来，这个不会在API交互文档中显示
 
 ''' ************** *********************** ************** '''
@@ -123,9 +124,45 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=['*'],  # 允许所有方法
     allow_headers=['*'],  # 允许所有头信息
+    expose_headers=['X-Next-Cursor', 'ETag', 'Last-Modified', 'X-DB-Query-Count', 'X-DB-Query-Time'],  # 允许前端JS读取的响应头
 )
 
 
+''' ************** *********************** ************** '''
+
+''' ************** 响应压缩 ************** '''
+
+from covid19.compression import CompressionMiddleware
+from covid19.settings import settings
+
+# 最后添加的中间件在最外层，压缩的是其他中间件处理完以后的响应；阈值、级别等配置见covid19/settings.py
+app.add_middleware(
+    CompressionMiddleware,
+    minimum_size=settings.compression_minimum_size,
+    gzip_level=settings.compression_gzip_level,
+    brotli_quality=settings.compression_brotli_quality,
+    offload_size=settings.compression_offload_size,
+)
+
+''' ************** *********************** ************** '''
+
+''' ************** SQL查询分析 ************** '''
+
+from covid19.profiler import QueryProfilerMiddleware
+
+# 每个请求的SQL条数和耗时放在响应头X-DB-Query-Count/X-DB-Query-Time里，同时记入/metrics；慢查询和疑似N+1记日志
+app.add_middleware(QueryProfilerMiddleware, routes=app.routes)     # route标签和下面的MetricsMiddleware一致
+
+''' ************** *********************** ************** '''
+
+''' ************** 请求指标（Prometheus） ************** '''
+
+from covid19.metrics import MetricsMiddleware, metrics_endpoint
+
+# 放在最外层：延迟包括其他中间件的处理时间，响应字节数是压缩后的大小。app.routes是路由列表本身，按路由模板分组
+app.add_middleware(MetricsMiddleware, routes=app.routes)
+app.add_route('/metrics', metrics_endpoint, include_in_schema=False)
+
 ''' ************** *********************** ************** '''
 
 
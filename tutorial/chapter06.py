@@ -20,7 +20,7 @@ OAuth2PasswordBearer并不会创建相应的URL路径操作，只是指明客户
 当请求到来的时候，FastAPI会检查请求的Authorization头信息，如果没有找到Authorization头信息，或者头信息的内容不是Bearer token，它会返回401状态码(UNAUTHORIZED)
 """
 
-from fastapi.security import OAuth2PasswordBearer
+from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from fastapi import Depends
 
 oauth2_schema = OAuth2PasswordBearer(tokenUrl='/chapter06/token')   # 请求Token的URL地址 http://127.0.0.1:8000/chapter06/token
@@ -82,7 +82,7 @@ def fake_decode_token(token:str):
 
 
 @app06.post('/token')
-async def login(form_data: OAuth2PasswordBearer= Depends()):  # 类作为依赖的导入方式
+async def login(form_data: OAuth2PasswordRequestForm = Depends()):  # 类作为依赖的导入方式
     user_dict = fake_users_db.get(form_data.username)
     if not user_dict:   # 没找到用户，报错
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Incorrect username or password')
@@ -157,7 +157,7 @@ class Token(BaseModel):
 
 from passlib.context import CryptContext
 from jose import JWTError, jwt
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 
 # bcrypt是加密算法，
 pwd_context = CryptContext(schemes=['bcrypt'], deprecated='auto')   # 用于对密码加密
@@ -202,7 +202,7 @@ def create_access_token(data:dict, expires_delta:Optional[timedelta]=None):
 
 # 写登录接口
 @app06.post('/jwt/token', response_model=Token)
-async def login_for_access_token(form_data: OAuth2PasswordBearer= Depends()):
+async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends()):
     # 校验用户是否存在，密码是否正确
     user = jwt_authenticate_user(fake_users_db, form_data.username, form_data.password)
     if not user:
@@ -230,7 +230,7 @@ async def jwt_get_current_user(token:str=Depends(oauth2_schema)):
     try:
         # 编码时用什么key和算法，解码时也用什么key和算法，要保持一致
         payload = jwt.decode(token=token, key=SECRET_KEY, algorithms=[ALGORITHM])
-        username = payload.get(key='sub')
+        username = payload.get('sub')
         if username is None:
             raise credentials_exception
     except JWTError:
@@ -0,0 +1,19 @@
+from fastapi.testclient import TestClient
+
+from run import app
+
+''' ************** Chapter06 OAuth2 JWT 测试用例  ************** '''
+
+
+client = TestClient(app)
+
+
+def test_jwt_token_and_users_me():  # 压测脚本benchmarks/bench_load.py也用这两个接口
+    response = client.post(url="/chapter06/jwt/token", data={"username": "john snow", "password": "secret"})
+    assert response.status_code == 200
+    token = response.json()["access_token"]
+    response = client.get(url="/chapter06/jwt/users/me", headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 200
+    assert response.json()["username"] == "john snow"
+    response = client.post(url="/chapter06/jwt/token", data={"username": "john snow", "password": "wrong"})
+    assert response.status_code == 401